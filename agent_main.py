@@ -1,17 +1,18 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
 import uuid
 from llama_index.core.agent import ReActAgent,FunctionCallingAgent
-from llama_index.core.tools import ToolOutput
+from llama_index.core.tools import ToolOutput, FunctionTool
 from llama_index.llms.openai import OpenAI
 from langchain_openai import ChatOpenAI
 from llama_index.llms.langchain import LangChainLLM
 from llama_index.llms.ollama import Ollama
 import asyncio
-from tool_code_executor import create_task_workspace
-from tool_code_executor import create_code_executor_docker_tool,create_code_executor_local_tool,close_docker_container,create_browser_docker_tool
-from tool_code_generator import create_code_generator_tool, get_model
+from tool_code_executor import create_task_workspace, end_task, close_all_docker_containers, validate_user_id
+from tool_code_executor import create_code_executor_docker_tool,create_code_executor_local_tool,close_docker_container,create_browser_docker_tool,get_warm_pool,prewarm_docker_container
+from tool_code_generator import create_code_generator_tool, get_model, get_llm
 from tool_webpage_crawler import create_webpage_crawler_tool
 from llama_index.core.llms import ChatMessage
+from agent_registry import AgentRegistry
 from prompts import REACT_AGENT_CONTEXT,DEFAULT_INITIAL_PLAN_PROMPT,DEFAULT_PLAN_REFINE_PROMPT
 from llama_index.core.agent import (
     StructuredPlannerAgent,
@@ -21,11 +22,12 @@ from llama_index.core.agent import (
 
 import shutil
 import os
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 
-# 全局变量 - Agent映射表（按用户ID组织）
-_agents: Dict[str, ReActAgent] = {}
+# 全局变量 - Agent注册表（按用户ID组织），淘汰Agent时同时关闭该用户的Docker容器
+_agents = AgentRegistry(on_evict=close_docker_container)
 
 def generate_task_id():
     """生成一个TASK开头的唯一ID"""
@@ -34,70 +36,118 @@ def generate_task_id():
 # model_name = "claude-opus-4"
 model_name = "deepseek-v3"
 
-def get_agent(
-    user_id: str = "default",
-    llm = None
-) -> ReActAgent:
-    
-    """获取或创建用户专属的Agent实例"""
-    global _agents
+# 所有Agent共享的工具实例：工具本身无状态，用户和任务通过调用参数区分
+_agent_tools: Optional[List[FunctionTool]] = None
+_agent_tools_lock = threading.Lock()
+
+def get_agent_tools() -> List[FunctionTool]:
+    """获取共享的Agent工具列表，第一次调用时创建"""
+    global _agent_tools
     
-    if user_id not in _agents:
-
-        # 如果没有提供LLM，创建默认的LLM
-        if llm is None:
-            llm = LangChainLLM(get_model(model_name))
-            # llm = LangChainLLM(get_model("deepseek-v3"))
-
-        # 创建用户专属的工具实例
-        tool_code_executor_docker = create_code_executor_docker_tool()
-        tool_browser_docker = create_browser_docker_tool()
-        tool_code_generator = create_code_generator_tool(model_name)
-        tool_webpage_crawler = create_webpage_crawler_tool()  # 新增网页采集工具
-        
-        # 创建用户专属的Agent
-        
-        _agents[user_id] = ReActAgent.from_tools(
-            max_iterations=50,
-            tools=[
+    with _agent_tools_lock:
+        if _agent_tools is None:
+            tool_code_executor_docker = create_code_executor_docker_tool()
+            tool_browser_docker = create_browser_docker_tool()
+            tool_code_generator = create_code_generator_tool(model_name)
+            tool_webpage_crawler = create_webpage_crawler_tool()  # 新增网页采集工具
+            _agent_tools = [
                 tool_code_generator,
                 tool_code_executor_docker, 
                 tool_browser_docker,
                 tool_webpage_crawler  # 添加到工具列表
-            ],
-            llm=llm,
-            verbose=True,
-            context=REACT_AGENT_CONTEXT
-        )
+            ]
+    
+    return _agent_tools
+
+def _create_agent(llm=None, chat_history: Optional[List[ChatMessage]] = None) -> ReActAgent:
+    """创建Agent实例，chat_history为之前保存的对话历史"""
+    # 如果没有提供LLM，使用共享的默认LLM
+    if llm is None:
+        llm = get_llm(model_name)
+        # llm = get_llm("deepseek-v3")
+
+    # 用户专属的只有Agent本身（对话记忆），工具和LLM都是共享的
+    return ReActAgent.from_tools(
+        max_iterations=50,
+        tools=get_agent_tools(),
+        llm=llm,
+        chat_history=chat_history,
+        verbose=True,
+        context=REACT_AGENT_CONTEXT
+    )
+
+def get_agent(
+    user_id: str = "default",
+    llm = None
+) -> ReActAgent:
     
-    return _agents[user_id]
+    """获取或创建用户专属的Agent实例，被淘汰过的用户会恢复之前的对话历史"""
+    return _agents.get(user_id, lambda chat_history: _create_agent(llm, chat_history))
+
+def use_agent(
+    user_id: str = "default",
+    llm = None
+):
+    """获取用户专属的Agent用于执行任务，with块内Agent不会被淘汰"""
+    return _agents.use(user_id, lambda chat_history: _create_agent(llm, chat_history))
 
 def close_agent(user_id: str = "default"):
-    """关闭特定用户的Agent和相关资源"""
-    global _agents
-    if user_id in _agents:
-        # 关闭该用户的Docker容器
-        close_docker_container(user_id)
-        # 移除Agent实例
-        del _agents[user_id]
+    """关闭特定用户的Agent和相关资源，对话历史保存到磁盘"""
+    _agents.remove(user_id)
 
 def close_all_agents():
     """关闭所有用户的Agent和相关资源"""
-    global _agents
-    # 获取所有用户ID的副本
-    user_ids = list(_agents.keys())
-    # 逐个关闭用户的Agent和资源
-    for user_id in user_ids:
-        close_agent(user_id)
+    _agents.remove_all()
+
+def prepare_task_input(user_id: str, task_id: str, query: str, filename: Optional[str] = None) -> Dict:
+    """创建任务工作目录，把data目录下要处理的文件拷贝进来，组装Agent的任务输入
+    
+    Raises:
+        FileNotFoundError: 文件不存在于data目录中
+        ValueError: 用户ID不合法
+    """
+    workspace_path = create_task_workspace(user_id, task_id)
+
+    if filename:
+        # 只允许data目录下的文件名，不允许路径
+        source_path = os.path.join(workspace_path, '../data', os.path.basename(filename))
+        print(f"source_path: {source_path}")
+        if os.path.basename(filename) != filename or not os.path.exists(source_path):
+            raise FileNotFoundError(f"文件 {filename} 不存在于data目录中")
+        
+        # 拷贝文件到工作目录
+        target_path = os.path.join(workspace_path, filename)
+        shutil.copy2(source_path, target_path)
+    else:
+        target_path = None
+        
+    return {
+        "user_id": user_id,
+        "task_id": task_id,
+        "task": query.strip(),
+        "target_file": target_path
+    }
 
 async def test_react_agent():
     try:
         print("欢迎使用Awesome Manus! 输入'exit'或'quit'退出程序。")
+
+        # 启动容器预热器（DOCKER_WARM_POOL_SIZE为0时不启用）
+        get_warm_pool()
+        # 提前创建共享的工具和LLM，第一个任务无需等待
+        get_agent_tools()
+        get_llm(model_name)
         
         # 获取用户ID
-        user_id = input("\n请输入用户ID (直接回车使用default): ").strip()
-        if not user_id:
-            user_id = "default"
+        while True:
+            user_id = input("\n请输入用户ID (直接回车使用default): ").strip() or "default"
+            try:
+                validate_user_id(user_id)
+                break
+            except ValueError as e:
+                print(f"错误：{str(e)}")
+        # 用户输入任务期间在后台启动该用户的容器
+        prewarm_docker_container(user_id)
 
         while True:
             # 获取用户输入的任务
@@ -114,44 +164,29 @@ async def test_react_agent():
             # 获取用户输入的文件名
             filename = input("\n请输入要处理的文件名 (位于data目录下): ").strip()
 
-            # 获取或创建用户专属的Agent
-            agent = get_agent(user_id)
-
             # 生成task_id并组装任务
             task_id = generate_task_id()
             
-            # 创建工作目录
-            workspace_path = create_task_workspace(user_id, task_id)
-
-            if filename:
-                # 检查文件是否存在
-                source_path = os.path.join(workspace_path, '../data', filename)
-                print(f"source_path: {source_path}")
-                if not os.path.exists(source_path):
-                    print(f"错误：文件 {filename} 不存在于data目录中")
-                    continue
-                
-                # 拷贝文件到工作目录
-                target_path = os.path.join(workspace_path, filename)
-                shutil.copy2(source_path, target_path)
-
-            else:
-                target_path = None
-                
-            task_input = {
-                "user_id": user_id,
-                "task_id": task_id,
-                "task": query.strip(),
-                "target_file": target_path
-            }
+            # 创建工作目录，拷贝要处理的文件
+            try:
+                task_input = prepare_task_input(user_id, task_id, query, filename)
+            except FileNotFoundError as e:
+                print(f"错误：{str(e)}")
+                continue
             
-            # 使用非流式响应
-            response = await agent.achat(str(task_input))
+            # 获取或创建用户专属的Agent，使用非流式响应
+            try:
+                with use_agent(user_id) as agent:
+                    response = await agent.achat(str(task_input))
+            finally:
+                # 任务结束，释放任务的常驻内核
+                end_task(user_id, task_id)
             print(f"任务执行结果: {response}")
 
     finally:
-        # 确保所有资源被清理
+        # 确保所有资源被清理，包括预热中的容器和回收线程
         close_all_agents()
+        close_all_docker_containers()
 
 if __name__ == "__main__":
     asyncio.run(test_react_agent())
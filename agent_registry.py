@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from llama_index.core.llms import ChatMessage, MessageRole
+
+# 同时保留在内存中的Agent数量上限，0表示不限制
+AGENT_MAX_COUNT = int(os.getenv("AGENT_MAX_COUNT", "100"))
+# Agent空闲多久（秒）后被淘汰，0表示不按空闲时间淘汰
+AGENT_IDLE_TTL = float(os.getenv("AGENT_IDLE_TTL", "1800"))
+# 被淘汰Agent的对话历史保存目录，设为空字符串时不保存
+AGENT_HISTORY_DIR = os.path.expanduser(os.getenv("AGENT_HISTORY_DIR", "~/.cache/agent_manus/history"))
+
+
+class _AgentEntry:
+    def __init__(self, agent: Any):
+        self.agent = agent
+        self.last_used = time.monotonic()
+        self.active = 0
+
+
+class AgentRegistry:
+    """按用户缓存Agent实例
+
+    最多保留max_agents个Agent，空闲超过idle_ttl秒或数量超过上限时淘汰最久未使用的Agent；
+    淘汰时把对话历史保存到磁盘，并调用on_evict释放用户的其他资源（如执行容器），
+    用户再次访问时用保存的对话历史重建Agent。正在执行任务（通过use获取）的Agent不会被淘汰。
+    用户的Agent正在被释放时，再次获取会等待释放完成，避免读到尚未保存的历史或新容器被释放过程关闭。
+    """
+    def __init__(
+        self,
+        on_evict: Optional[Callable[[str], None]] = None,
+        max_agents: int = AGENT_MAX_COUNT,
+        idle_ttl: float = AGENT_IDLE_TTL,
+        history_dir: str = AGENT_HISTORY_DIR
+    ):
+        self.on_evict = on_evict
+        self.max_agents = max_agents
+        self.idle_ttl = idle_ttl
+        self.history_dir = history_dir
+        # 按最近使用顺序排列，最久未使用的在前
+        self._entries: Dict[str, _AgentEntry] = {}
+        # 正在保存历史和释放资源的用户，释放完成时设置对应的事件
+        self._releasing: Dict[str, threading.Event] = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def user_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def get(self, user_id: str, create: Callable[[List[ChatMessage]], Any]) -> Any:
+        """获取用户的Agent，不存在时用保存的对话历史调用create创建
+
+        Args:
+            user_id: 用户ID
+            create: 以对话历史为参数创建Agent的函数
+        """
+        agent = self._acquire(user_id, create, active=False).agent
+        self.evict_expired()
+        return agent
+
+    @contextmanager
+    def use(self, user_id: str, create: Callable[[List[ChatMessage]], Any]) -> Iterator[Any]:
+        """在执行任务期间获取Agent，期间不会被淘汰"""
+        entry = self._acquire(user_id, create, active=True)
+        self.evict_expired()
+        try:
+            yield entry.agent
+        finally:
+            with self._lock:
+                entry.active -= 1
+                entry.last_used = time.monotonic()
+
+    def _acquire(self, user_id: str, create: Callable[[List[ChatMessage]], Any], active: bool) -> _AgentEntry:
+        """获取或创建用户的Agent条目，用户正在被释放时先等待释放完成"""
+        while True:
+            with self._lock:
+                releasing = self._releasing.get(user_id)
+                if releasing is None:
+                    entry = self._touch(user_id, create)
+                    if active:
+                        entry.active += 1
+                    return entry
+            releasing.wait()
+
+    def _touch(self, user_id: str, create: Callable[[List[ChatMessage]], Any]) -> _AgentEntry:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            entry = _AgentEntry(create(self.load_history(user_id)))
+        entry.last_used = time.monotonic()
+        self._entries[user_id] = entry
+        return entry
+
+    def evict_expired(self) -> List[str]:
+        """淘汰空闲超时的Agent，以及超过数量上限时最久未使用的Agent
+
+        Returns:
+            List[str]: 被淘汰的用户ID
+        """
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            idle = [user_id for user_id, entry in self._entries.items() if entry.active == 0]
+            excess = len(self._entries) - self.max_agents if self.max_agents > 0 else 0
+            for user_id in idle:
+                expired = self.idle_ttl > 0 and now - self._entries[user_id].last_used > self.idle_ttl
+                if not expired and len(evicted) >= excess:
+                    continue
+                evicted.append((user_id, self._entries.pop(user_id)))
+                self._releasing[user_id] = threading.Event()
+
+        # 保存历史和释放资源可能较慢，不持有锁
+        for user_id, entry in evicted:
+            self._release(user_id, entry)
+        return [user_id for user_id, _ in evicted]
+
+    def remove(self, user_id: str) -> bool:
+        """移除用户的Agent，保存对话历史并释放资源"""
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is None:
+                return False
+            self._releasing[user_id] = threading.Event()
+        self._release(user_id, entry)
+        return True
+
+    def remove_all(self) -> None:
+        """移除所有Agent"""
+        for user_id in self.user_ids():
+            self.remove(user_id)
+
+    def _release(self, user_id: str, entry: _AgentEntry) -> None:
+        """保存历史并释放资源，调用前需已在_releasing中登记该用户"""
+        try:
+            try:
+                self.save_history(user_id, entry.agent.chat_history)
+            except Exception as e:
+                print(f"保存用户 {user_id} 的对话历史失败: {str(e)}")
+            if self.on_evict is not None:
+                try:
+                    self.on_evict(user_id)
+                except Exception as e:
+                    print(f"释放用户 {user_id} 的资源失败: {str(e)}")
+        finally:
+            with self._lock:
+                releasing = self._releasing.pop(user_id)
+            releasing.set()
+
+    def _history_path(self, user_id: str) -> str:
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.history_dir, f"{digest}.json")
+
+    def save_history(self, user_id: str, messages: List[ChatMessage]) -> None:
+        """把对话历史保存到磁盘"""
+        if not self.history_dir:
+            return
+        os.makedirs(self.history_dir, exist_ok=True)
+        path = self._history_path(user_id)
+        data = {
+            "user_id": user_id,
+            "messages": [
+                {"role": MessageRole(message.role).value, "content": message.content or ""}
+                for message in messages
+            ]
+        }
+        # 先写临时文件再替换，避免中途出错留下不完整的文件
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def load_history(self, user_id: str) -> List[ChatMessage]:
+        """读取保存的对话历史，没有时返回空列表"""
+        if not self.history_dir:
+            return []
+        try:
+            with open(self._history_path(user_id), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if data.get("user_id") != user_id:
+            return []
+        return [
+            ChatMessage(role=MessageRole(message["role"]), content=message["content"])
+            for message in data.get("messages", [])
+        ]
@@ -0,0 +1,405 @@
+import os
+import hmac
+import json
+import time
+import asyncio
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from aiohttp import web
+
+from agent_main import generate_task_id, prepare_task_input, use_agent, close_all_agents, get_agent_tools, model_name
+from tool_code_executor import get_warm_pool, add_output_listener, remove_output_listener, cancel_execution, end_task, prewarm_docker_container
+from tool_code_executor import close_all_docker_containers, validate_user_id
+from tool_code_generator import get_llm
+from async_executor import run_blocking
+
+# 服务监听地址，默认只监听本机
+AGENT_SERVER_HOST = os.getenv("AGENT_SERVER_HOST", "127.0.0.1")
+AGENT_SERVER_PORT = int(os.getenv("AGENT_SERVER_PORT", "8080"))
+# 访问令牌及其可操作的用户，格式为 "令牌:用户1|用户2,令牌:*"，*表示可操作所有用户
+AGENT_SERVER_TOKENS = os.getenv("AGENT_SERVER_TOKENS", "")
+# 所有用户同时执行的最大任务数（同一用户的任务总是依次执行）
+AGENT_SERVER_MAX_TASKS = int(os.getenv("AGENT_SERVER_MAX_TASKS", "8"))
+# 每个用户排队等待的最大任务数
+AGENT_SERVER_USER_QUEUE_SIZE = int(os.getenv("AGENT_SERVER_USER_QUEUE_SIZE", "16"))
+# 已结束任务的记录保留时间（秒）
+AGENT_SERVER_TASK_TTL = float(os.getenv("AGENT_SERVER_TASK_TTL", "3600"))
+# 每个事件订阅者缓存的最大事件数，客户端读取过慢时丢弃新事件
+EVENT_QUEUE_SIZE = 1000
+# 事件流没有事件时发送心跳的间隔（秒）
+SSE_KEEPALIVE_INTERVAL = 15
+
+FINISHED_STATUSES = {"succeeded", "failed", "cancelled"}
+
+
+class TaskCancelled(Exception):
+    """任务在执行过程中被取消"""
+
+
+def parse_tokens(value: str) -> Dict[str, Set[str]]:
+    """解析AGENT_SERVER_TOKENS，返回令牌到可操作用户ID集合的映射"""
+    tokens: Dict[str, Set[str]] = {}
+    for item in value.split(","):
+        token, _, users = item.strip().partition(":")
+        token = token.strip()
+        if token:
+            tokens.setdefault(token, set()).update(user.strip() for user in users.split("|") if user.strip())
+    return tokens
+
+
+@dataclass
+class TaskRecord:
+    task_id: str
+    user_id: str
+    task: str
+    filename: Optional[str] = None
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[str] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "task_id": self.task_id,
+            "user_id": self.user_id,
+            "task": self.task,
+            "filename": self.filename,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class EventHub:
+    """按用户分发任务事件给SSE/WebSocket订阅者"""
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    @contextmanager
+    def subscribe(self, user_id: str) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(user_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[user_id]
+
+    def publish(self, user_id: str, event: Dict[str, Any]) -> None:
+        """发布事件，只能在事件循环线程中调用"""
+        event.setdefault("time", time.time())
+        for queue in list(self._subscribers.get(user_id, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    def publish_threadsafe(self, user_id: str, event: Dict[str, Any]) -> None:
+        """从工具线程发布事件"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.publish, user_id, event)
+
+
+class AgentServer:
+    """多用户Agent服务
+
+    HTTP提交任务，每个用户的任务进入各自的队列依次执行，不同用户的任务并发执行；
+    任务状态、Agent推理步骤和代码执行的实时输出通过SSE或WebSocket推送给用户。
+    每个请求都需要携带访问令牌（Authorization: Bearer <令牌>，浏览器的SSE/WebSocket可用?token=参数），
+    令牌只能操作配置中允许的用户；没有配置令牌时拒绝所有请求。
+    """
+    def __init__(
+        self,
+        max_tasks: int = AGENT_SERVER_MAX_TASKS,
+        user_queue_size: int = AGENT_SERVER_USER_QUEUE_SIZE,
+        task_ttl: float = AGENT_SERVER_TASK_TTL,
+        tokens: Optional[Dict[str, Set[str]]] = None
+    ):
+        self.max_tasks = max_tasks
+        self.user_queue_size = user_queue_size
+        self.task_ttl = task_ttl
+        self.tokens = parse_tokens(AGENT_SERVER_TOKENS) if tokens is None else tokens
+        self.hub = EventHub()
+        self._tasks: Dict[str, TaskRecord] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/tasks", self.submit_task),
+            web.get("/tasks/{task_id}", self.get_task),
+            web.post("/tasks/{task_id}/cancel", self.cancel_task),
+            web.get("/users/{user_id}/tasks", self.list_tasks),
+            web.get("/users/{user_id}/events", self.stream_events),
+            web.get("/users/{user_id}/ws", self.websocket_events),
+        ])
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app: web.Application) -> None:
+        if not self.tokens:
+            print("警告: 未配置AGENT_SERVER_TOKENS，所有请求都会被拒绝")
+        self.hub.bind(asyncio.get_running_loop())
+        self._slots = asyncio.Semaphore(self.max_tasks)
+        add_output_listener(self._on_output)
+        # 启动容器预热器，创建共享的工具和LLM
+        get_warm_pool()
+        await run_blocking(get_agent_tools)
+        await run_blocking(get_llm, model_name)
+
+    async def _on_cleanup(self, app: web.Application) -> None:
+        remove_output_listener(self._on_output)
+        for record in self._tasks.values():
+            if record.status not in FINISHED_STATUSES:
+                record.cancel_requested = True
+                cancel_execution(record.user_id, record.task_id)
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        await run_blocking(close_all_agents)
+        # 停止预热和回收线程，关闭剩余的容器
+        await run_blocking(close_all_docker_containers)
+
+    def _authorize(self, request: web.Request, user_id: str) -> str:
+        """校验请求的令牌可以操作该用户，返回合法的用户ID
+
+        Raises:
+            web.HTTPBadRequest: 用户ID不合法
+            web.HTTPUnauthorized: 缺少令牌或令牌无效
+            web.HTTPForbidden: 令牌无权操作该用户
+        """
+        try:
+            validate_user_id(user_id)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        users = self._authenticate(request)
+        if "*" not in users and user_id not in users:
+            raise web.HTTPForbidden(text=f"无权操作用户 {user_id}")
+        return user_id
+
+    def _authenticate(self, request: web.Request) -> Set[str]:
+        """返回请求令牌可操作的用户ID集合"""
+        header = request.headers.get("Authorization", "")
+        scheme, _, token = header.partition(" ")
+        if scheme.lower() != "bearer" or not token.strip():
+            token = request.query.get("token", "")
+        token = token.strip()
+        # 逐个比较所有令牌，比较耗时与令牌内容无关
+        users: Optional[Set[str]] = None
+        for known_token, known_users in self.tokens.items():
+            if hmac.compare_digest(known_token.encode("utf-8"), token.encode("utf-8")):
+                users = known_users
+        if not token or users is None:
+            raise web.HTTPUnauthorized(text="缺少访问令牌或令牌无效", headers={"WWW-Authenticate": "Bearer"})
+        return users
+
+    def _get_record(self, request: web.Request) -> TaskRecord:
+        """按路径中的任务ID获取任务记录，并校验令牌可以操作任务所属用户"""
+        self._authenticate(request)
+        record = self._tasks.get(request.match_info["task_id"])
+        if record is None:
+            raise web.HTTPNotFound(text="任务不存在")
+        self._authorize(request, record.user_id)
+        return record
+
+    def _on_output(self, user_id: str, task_id: str, stream: str, text: str) -> None:
+        self.hub.publish_threadsafe(user_id, {"type": "output", "task_id": task_id, "stream": stream, "text": text})
+
+    def _set_status(self, record: TaskRecord, status: str) -> None:
+        record.status = status
+        if status == "running":
+            record.started_at = time.time()
+        elif status in FINISHED_STATUSES:
+            record.finished_at = time.time()
+        self.hub.publish(record.user_id, {"type": "status", **record.to_dict()})
+
+    def _prune_tasks(self) -> None:
+        """删除过期的已结束任务记录"""
+        now = time.time()
+        expired = [
+            task_id for task_id, record in self._tasks.items()
+            if record.status in FINISHED_STATUSES and now - record.finished_at > self.task_ttl
+        ]
+        for task_id in expired:
+            del self._tasks[task_id]
+
+    async def submit_task(self, request: web.Request) -> web.Response:
+        """提交任务: {"user_id": ..., "task": ..., "filename": 可选，data目录下的文件名}"""
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="请求体必须是JSON")
+        user_id = self._authorize(request, str(body.get("user_id") or "default"))
+        query = str(body.get("task") or "").strip()
+        if not query:
+            raise web.HTTPBadRequest(text="缺少task")
+
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = asyncio.Queue(maxsize=self.user_queue_size)
+        if queue.full():
+            raise web.HTTPTooManyRequests(text=f"用户 {user_id} 排队的任务过多")
+
+        self._prune_tasks()
+        record = TaskRecord(task_id=generate_task_id(), user_id=user_id, task=query, filename=body.get("filename"))
+        self._tasks[record.task_id] = record
+        queue.put_nowait(record)
+        self._set_status(record, "queued")
+
+        # LLM生成第一步期间在后台启动用户的容器
+        prewarm_docker_container(user_id)
+
+        # 每个用户一个执行协程，队列为空时退出
+        if user_id not in self._workers:
+            self._workers[user_id] = asyncio.create_task(self._run_user_queue(user_id))
+
+        return web.json_response({**record.to_dict(), "position": queue.qsize()}, status=202)
+
+    async def get_task(self, request: web.Request) -> web.Response:
+        record = self._get_record(request)
+        return web.json_response(record.to_dict())
+
+    async def list_tasks(self, request: web.Request) -> web.Response:
+        user_id = self._authorize(request, request.match_info["user_id"])
+        records = [record.to_dict() for record in self._tasks.values() if record.user_id == user_id]
+        return web.json_response(records)
+
+    async def cancel_task(self, request: web.Request) -> web.Response:
+        """取消任务：排队中的任务直接取消，执行中的任务结束正在运行的代码并在当前步骤后停止"""
+        record = self._get_record(request)
+        if record.status not in FINISHED_STATUSES:
+            record.cancel_requested = True
+            if record.status == "queued":
+                self._set_status(record, "cancelled")
+            else:
+                await run_blocking(cancel_execution, record.user_id, record.task_id)
+        return web.json_response(record.to_dict())
+
+    async def _run_user_queue(self, user_id: str) -> None:
+        queue = self._queues[user_id]
+        try:
+            while not queue.empty():
+                record = queue.get_nowait()
+                if record.cancel_requested:
+                    continue
+                async with self._slots:
+                    await self._run_task(record)
+        finally:
+            # 检查队列和删除之间没有await，期间不会有新任务加入
+            self._workers.pop(user_id, None)
+            if queue.empty():
+                self._queues.pop(user_id, None)
+
+    async def _run_task(self, record: TaskRecord) -> None:
+        if record.cancel_requested:
+            return
+        self._set_status(record, "running")
+        try:
+            task_input = await run_blocking(
+                prepare_task_input, record.user_id, record.task_id, record.task, record.filename
+            )
+            # 获取和释放Agent时可能淘汰其他用户的Agent（保存历史、停止容器），放到线程中执行避免阻塞事件循环
+            agent_context = use_agent(record.user_id)
+            agent = await run_blocking(agent_context.__enter__)
+            try:
+                response = await self._run_agent(agent, record, task_input)
+            finally:
+                await run_blocking(agent_context.__exit__, None, None, None)
+            record.result = str(response)
+            self._set_status(record, "succeeded")
+        except TaskCancelled:
+            self._set_status(record, "cancelled")
+        except Exception as e:
+            record.error = str(e)
+            self._set_status(record, "cancelled" if record.cancel_requested else "failed")
+        finally:
+            # 任务结束，释放任务的常驻内核
+            await run_blocking(end_task, record.user_id, record.task_id)
+
+    async def _run_agent(self, agent, record: TaskRecord, task_input: Dict[str, Any]):
+        """逐步执行Agent任务，每一步推送新的推理内容，步骤之间检查是否已取消"""
+        task = agent.create_task(str(task_input))
+        published = 0
+        try:
+            while True:
+                if record.cancel_requested:
+                    raise TaskCancelled()
+                step_output = await agent.arun_step(task.task_id)
+                reasoning: List = task.extra_state.get("current_reasoning", [])
+                for step in reasoning[published:]:
+                    self.hub.publish(record.user_id, {
+                        "type": "step",
+                        "task_id": record.task_id,
+                        "content": step.get_content()
+                    })
+                published = len(reasoning)
+                if step_output.is_last:
+                    return agent.finalize_response(task.task_id, step_output=step_output)
+        except BaseException:
+            agent.delete_task(task.task_id)
+            raise
+
+    async def stream_events(self, request: web.Request) -> web.StreamResponse:
+        """以SSE推送用户的任务事件"""
+        user_id = self._authorize(request, request.match_info["user_id"])
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+        await response.prepare(request)
+        with self.hub.subscribe(user_id) as queue:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                data = json.dumps(event, ensure_ascii=False)
+                await response.write(f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"))
+
+    async def websocket_events(self, request: web.Request) -> web.WebSocketResponse:
+        """以WebSocket推送用户的任务事件"""
+        user_id = self._authorize(request, request.match_info["user_id"])
+        ws = web.WebSocketResponse(heartbeat=SSE_KEEPALIVE_INTERVAL)
+        await ws.prepare(request)
+        with self.hub.subscribe(user_id) as queue:
+            sender = asyncio.create_task(self._send_events(ws, queue))
+            try:
+                # 只推送事件，客户端消息忽略，循环结束表示连接已关闭
+                async for _ in ws:
+                    pass
+            finally:
+                sender.cancel()
+        return ws
+
+    async def _send_events(self, ws: web.WebSocketResponse, queue: asyncio.Queue) -> None:
+        while not ws.closed:
+            event = await queue.get()
+            await ws.send_json(event, dumps=lambda data: json.dumps(data, ensure_ascii=False))
+
+
+def create_app() -> web.Application:
+    return AgentServer().create_app()
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=AGENT_SERVER_HOST, port=AGENT_SERVER_PORT)
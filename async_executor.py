@@ -0,0 +1,44 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+# 工具阻塞调用（docker-py、requests、LLM客户端）使用的最大线程数
+TOOL_THREAD_POOL_SIZE = int(os.getenv("TOOL_THREAD_POOL_SIZE", "32"))
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """获取工具共享的有界线程池"""
+    global _tool_executor
+
+    with _tool_executor_lock:
+        if _tool_executor is None:
+            _tool_executor = ThreadPoolExecutor(max_workers=TOOL_THREAD_POOL_SIZE, thread_name_prefix="tool-worker")
+
+    return _tool_executor
+
+async def run_blocking(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在有界线程池中运行阻塞函数，不阻塞事件循环
+
+    Args:
+        fn: 阻塞函数
+        *args, **kwargs: 传给fn的参数
+
+    Returns:
+        fn的返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_tool_executor(), functools.partial(fn, *args, **kwargs))
+
+def shutdown_tool_executor() -> None:
+    """关闭工具线程池"""
+    global _tool_executor
+
+    with _tool_executor_lock:
+        if _tool_executor is not None:
+            _tool_executor.shutdown(wait=False)
+            _tool_executor = None
@@ -0,0 +1,63 @@
+"""并发会话基准测试
+
+比较在同一个事件循环中，N个用户会话同时调用docker代码执行工具时，
+同步调用（tool.call，阻塞事件循环）与异步调用（tool.acall，线程池执行）的总耗时。
+
+用法:
+    python benchmark_concurrency.py --sessions 1 2 4 8 16 --sleep 1
+
+需要本地Docker环境和 python_code_executor:3.11 镜像；会话数超过 TOOL_THREAD_POOL_SIZE 时异步调用会排队。
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from tool_code_executor import create_code_executor_docker_tool, close_all_docker_containers
+
+
+async def run_session(tool, user_id: str, task_id: str, code: str, use_async: bool) -> bool:
+    if use_async:
+        output = await tool.acall(code=code, language="python", user_id=user_id, task_id=task_id)
+    else:
+        output = tool.call(code=code, language="python", user_id=user_id, task_id=task_id)
+    return json.loads(output.content)["success"]
+
+
+async def run_round(tool, sessions: int, code: str, use_async: bool) -> float:
+    # 每个会话使用固定任务ID，复用已启动的内核
+    task_id = "TASK-bench"
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_session(tool, f"bench-{i}", task_id, code, use_async)
+        for i in range(sessions)
+    ])
+    elapsed = time.perf_counter() - start
+    if not all(results):
+        print("警告: 部分执行失败")
+    return elapsed
+
+
+async def main(session_counts, sleep_seconds: float):
+    tool = create_code_executor_docker_tool()
+    code = f"import time\ntime.sleep({sleep_seconds})\nprint('done')"
+
+    try:
+        # 预先创建所有会话的容器，容器启动时间不计入结果
+        await run_round(tool, max(session_counts), "print('warm up')", use_async=True)
+
+        print(f"{'会话数':>6} {'同步耗时(s)':>12} {'异步耗时(s)':>12} {'加速比':>8}")
+        for sessions in session_counts:
+            sync_elapsed = await run_round(tool, sessions, code, use_async=False)
+            async_elapsed = await run_round(tool, sessions, code, use_async=True)
+            print(f"{sessions:>6} {sync_elapsed:>12.2f} {async_elapsed:>12.2f} {sync_elapsed / async_elapsed:>8.2f}")
+    finally:
+        close_all_docker_containers()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="docker代码执行工具并发基准测试")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="并发会话数")
+    parser.add_argument("--sleep", type=float, default=1.0, help="每次执行中代码休眠的秒数")
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.sleep))
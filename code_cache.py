@@ -0,0 +1,116 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import Optional
+
+# 代码生成结果缓存：SQLite文件路径与最大条目数（0表示不启用缓存）
+CODE_CACHE_PATH = os.path.expanduser(os.getenv("CODE_CACHE_PATH", "~/.cache/agent_manus/code_generation.sqlite3"))
+CODE_CACHE_MAX_ENTRIES = int(os.getenv("CODE_CACHE_MAX_ENTRIES", "1000"))
+
+_code_cache: Optional["CodeCache"] = None
+_code_cache_lock = threading.Lock()
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """规范化输入文本：统一全角/半角字符，合并连续空白，去掉首尾空白"""
+    if not text:
+        return ""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class CodeCache:
+    """按内容寻址的代码生成结果缓存
+
+    缓存键由模型名称、提示词模板的哈希和规范化后的输入计算得到，
+    提示词模板修改后旧的缓存条目自然失效。超过max_entries时淘汰最久未使用的条目。
+    """
+    def __init__(self, path: str = CODE_CACHE_PATH, max_entries: int = CODE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._conn:
+            # WAL允许多个进程同时读取缓存
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS code_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    code TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS code_cache_last_used ON code_cache (last_used)")
+
+    @staticmethod
+    def make_key(model_name: str, prompt_template: str, *inputs: Optional[str]) -> str:
+        """计算缓存键
+
+        Args:
+            model_name: 模型名称
+            prompt_template: 提示词模板，取其哈希作为版本
+            *inputs: 影响生成结果的输入，例如渲染后的完整提示词
+        """
+        template_version = hashlib.sha256(prompt_template.encode("utf-8")).hexdigest()
+        parts = [model_name, template_version] + [normalize_text(text) for text in inputs]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的代码，未命中返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT code FROM code_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE code_cache SET last_used = ?, hits = hits + 1 WHERE key = ?",
+                    (time.time(), key)
+                )
+        return row[0]
+
+    def put(self, key: str, model_name: str, code: str) -> None:
+        """写入生成的代码，并按最近使用时间淘汰超出上限的条目"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO code_cache (key, model, code, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model_name, code, now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM code_cache WHERE key IN ("
+                "SELECT key FROM code_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def clear(self) -> None:
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM code_cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def get_code_cache() -> Optional[CodeCache]:
+    """获取共享的代码生成缓存，CODE_CACHE_MAX_ENTRIES为0时返回None"""
+    global _code_cache
+
+    if CODE_CACHE_MAX_ENTRIES <= 0:
+        return None
+
+    with _code_cache_lock:
+        if _code_cache is None:
+            _code_cache = CodeCache()
+
+    return _code_cache
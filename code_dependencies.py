@@ -0,0 +1,130 @@
+import os
+import ast
+import sys
+from typing import Dict, List, Set
+
+from wheelhouse import canonical_package_name
+
+# 导入名与pip包名不一致的常见第三方库
+IMPORT_PACKAGE_MAP: Dict[str, str] = {
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python-headless",
+    "Crypto": "pycryptodome",
+    "dateutil": "python-dateutil",
+    "docx": "python-docx",
+    "dotenv": "python-dotenv",
+    "fitz": "PyMuPDF",
+    "jwt": "PyJWT",
+    "magic": "python-magic",
+    "PIL": "Pillow",
+    "pptx": "python-pptx",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "yaml": "PyYAML",
+}
+
+# 允许自动安装的常用包（导入名与包名一致），IMPORT_PACKAGE_MAP中的包同样允许
+DEFAULT_AUTO_INSTALL_PACKAGES = [
+    "numpy", "pandas", "scipy", "matplotlib", "seaborn", "plotly", "statsmodels",
+    "sympy", "networkx", "requests", "openpyxl", "xlrd", "xlsxwriter", "lxml",
+    "tabulate", "tqdm", "jieba", "wordcloud", "pyarrow", "chardet",
+]
+# 额外允许自动安装的包，逗号分隔
+AUTO_INSTALL_EXTRA_PACKAGES = [
+    package.strip() for package in os.getenv("AUTO_INSTALL_EXTRA_PACKAGES", "").split(",") if package.strip()
+]
+# 代码中未能解析的导入名只有在允许列表中（或本地wheel仓库中已有）时才自动安装，
+# 避免把LLM臆造的包名直接从PyPI安装
+AUTO_INSTALL_ALLOWLIST: Set[str] = {
+    canonical_package_name(package)
+    for package in [*DEFAULT_AUTO_INSTALL_PACKAGES, *IMPORT_PACKAGE_MAP.values(), *AUTO_INSTALL_EXTRA_PACKAGES]
+}
+
+# 执行容器（Python 3.11）的标准库模块，Python 3.9等没有sys.stdlib_module_names的宿主机使用这份列表
+_STATIC_STDLIB_MODULES = {
+    "__future__", "_thread", "abc", "aifc", "antigravity", "argparse", "array", "ast", "asynchat",
+    "asyncio", "asyncore", "atexit", "audioop", "base64", "bdb", "binascii", "bisect", "builtins",
+    "bz2", "cProfile", "calendar", "cgi", "cgitb", "chunk", "cmath", "cmd", "code", "codecs",
+    "codeop", "collections", "colorsys", "compileall", "concurrent", "configparser", "contextlib",
+    "contextvars", "copy", "copyreg", "crypt", "csv", "ctypes", "curses", "dataclasses", "datetime",
+    "dbm", "decimal", "difflib", "dis", "distutils", "doctest", "email", "encodings", "ensurepip",
+    "enum", "errno", "faulthandler", "fcntl", "filecmp", "fileinput", "fnmatch", "fractions",
+    "ftplib", "functools", "gc", "genericpath", "getopt", "getpass", "gettext", "glob", "graphlib",
+    "grp", "gzip", "hashlib", "heapq", "hmac", "html", "http", "idlelib", "imaplib", "imghdr",
+    "imp", "importlib", "inspect", "io", "ipaddress", "itertools", "json", "keyword", "lib2to3",
+    "linecache", "locale", "logging", "lzma", "mailbox", "mailcap", "marshal", "math", "mimetypes",
+    "mmap", "modulefinder", "msilib", "msvcrt", "multiprocessing", "netrc", "nis", "nntplib", "nt",
+    "ntpath", "nturl2path", "numbers", "opcode", "operator", "optparse", "os", "ossaudiodev",
+    "pathlib", "pdb", "pickle", "pickletools", "pipes", "pkgutil", "platform", "plistlib", "poplib",
+    "posix", "posixpath", "pprint", "profile", "pstats", "pty", "pwd", "py_compile", "pyclbr",
+    "pydoc", "pydoc_data", "pyexpat", "queue", "quopri", "random", "re", "readline", "reprlib",
+    "resource", "rlcompleter", "runpy", "sched", "secrets", "select", "selectors", "shelve",
+    "shlex", "shutil", "signal", "site", "smtpd", "smtplib", "sndhdr", "socket", "socketserver",
+    "spwd", "sqlite3", "sre_compile", "sre_constants", "sre_parse", "ssl", "stat", "statistics",
+    "string", "stringprep", "struct", "subprocess", "sunau", "symtable", "sys", "sysconfig",
+    "syslog", "tabnanny", "tarfile", "telnetlib", "tempfile", "termios", "textwrap", "this",
+    "threading", "time", "timeit", "tkinter", "token", "tokenize", "tomllib", "trace", "traceback",
+    "tracemalloc", "tty", "turtle", "turtledemo", "types", "typing", "unicodedata", "unittest",
+    "urllib", "uu", "uuid", "venv", "warnings", "wave", "weakref", "webbrowser", "winreg",
+    "winsound", "wsgiref", "xdrlib", "xml", "xmlrpc", "zipapp", "zipfile", "zipimport", "zlib",
+    "zoneinfo"
+}
+# 标准库模块（Python 3.10+ 提供 sys.stdlib_module_names）
+STDLIB_MODULES: Set[str] = set(getattr(sys, "stdlib_module_names", ())) | _STATIC_STDLIB_MODULES
+
+_IMPORT_ERRORS = {"ImportError", "ModuleNotFoundError"}
+
+
+def _handles_import_error(node: ast.Try) -> bool:
+    for handler in node.handlers:
+        if handler.type is None:
+            return True
+        names = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        if any(isinstance(name, ast.Name) and name.id in _IMPORT_ERRORS for name in names):
+            return True
+    return False
+
+
+def find_imports(code: str) -> Set[str]:
+    """分析Python代码导入的顶层模块名
+
+    try/except ImportError 中的可选导入不计入；代码无法解析时返回空集合。
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return set()
+
+    modules: Set[str] = set()
+
+    def visit(node: ast.AST) -> None:
+        if isinstance(node, ast.Try) and _handles_import_error(node):
+            # 只跳过try主体，except/else/finally中的导入照常分析
+            for child in node.handlers + node.orelse + node.finalbody:
+                visit(child)
+            return
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            modules.add(node.module.split(".")[0])
+        for child in ast.iter_child_nodes(node):
+            visit(child)
+
+    visit(tree)
+    return modules
+
+
+def third_party_imports(code: str) -> List[str]:
+    """返回代码导入的非标准库模块名（已排序）"""
+    return sorted(module for module in find_imports(code) if module not in STDLIB_MODULES)
+
+
+def package_name(module: str) -> str:
+    """把导入名转换为pip包名"""
+    return IMPORT_PACKAGE_MAP.get(module, module)
+
+
+def is_auto_install_allowed(package: str) -> bool:
+    """pip包是否在自动安装允许列表中"""
+    return canonical_package_name(package) in AUTO_INSTALL_ALLOWLIST
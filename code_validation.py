@@ -0,0 +1,100 @@
+import os
+import re
+import sys
+import shutil
+import warnings
+import traceback
+import subprocess
+from typing import Optional, Tuple
+
+# 匹配markdown代码块，例如 ```python ... ```
+CODE_FENCE_PATTERN = re.compile(r"```[^\n`]*\n(.*?)(?:\n)?```", re.DOTALL)
+# 单独一行的代码块标记
+FENCE_LINE_PATTERN = re.compile(r"^\s*```[^\n`]*\s*$", re.MULTILINE)
+
+# bash -n 检查的超时时间（秒）
+SHELL_CHECK_TIMEOUT = 5
+# 执行容器中的Python版本；宿主机版本更低时无法识别新语法（例如match语句），不能据此判定语法错误
+EXECUTION_PYTHON_VERSION: Tuple[int, ...] = tuple(
+    int(part) for part in os.getenv("EXECUTION_PYTHON_VERSION", "3.11").split(".")[:2]
+)
+
+
+def _remove_code_fences(code: str) -> str:
+    """包含完整代码块时只保留代码块内的内容（多个代码块按顺序拼接），否则只删除单独成行的代码块标记"""
+    blocks = CODE_FENCE_PATTERN.findall(code)
+    if blocks:
+        return "\n".join(blocks)
+    return FENCE_LINE_PATTERN.sub("", code)
+
+
+def strip_code_fences(code: str, language: str = "python") -> str:
+    """去掉LLM输出中的markdown代码块标记
+
+    只在以下情况处理，避免误删代码中合法出现的代码块标记（例如字符串中的markdown）:
+    整段输入以 ``` 开头，此时代码块外的解释文字被丢弃；
+    或原始代码无法通过语法检查、而去掉标记后可以通过。
+    """
+    if code.strip().startswith("```"):
+        return _remove_code_fences(code)
+    if "```" not in code or validate_code(code, language) is None:
+        return code
+    stripped = _remove_code_fences(code)
+    if validate_code(stripped, language) is None:
+        return stripped
+    return code
+
+
+def check_python_syntax(code: str, target_version: Tuple[int, ...] = EXECUTION_PYTHON_VERSION) -> Optional[str]:
+    """编译Python代码检查语法，返回错误信息，没有错误时返回None
+
+    宿主机Python版本低于执行代码的target_version时，编译失败可能只是宿主机不支持新语法，
+    此时不报告语法错误，交给容器执行时再报告。
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            compile(code, "<code>", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        if sys.version_info[:2] < tuple(target_version):
+            return None
+        return "".join(traceback.format_exception_only(type(e), e))
+    except ValueError as e:
+        # 例如代码中包含空字符
+        return f"ValueError: {str(e)}\n"
+    return None
+
+
+def check_shell_syntax(code: str) -> Optional[str]:
+    """用 bash -n 检查Shell脚本语法，宿主机没有bash时跳过检查"""
+    if shutil.which("bash") is None:
+        return None
+    try:
+        process = subprocess.run(
+            ["bash", "-n"],
+            input=code,
+            capture_output=True,
+            text=True,
+            timeout=SHELL_CHECK_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if process.returncode != 0:
+        return process.stderr or f"bash -n 退出码: {process.returncode}\n"
+    return None
+
+
+def validate_code(code: str, language: str) -> Optional[str]:
+    """在宿主机上检查代码语法，避免语法错误的代码进入容器执行
+
+    Args:
+        code: 已去掉代码块标记的代码
+        language: 代码语言 ("python", "bash", "sh")
+
+    Returns:
+        语法错误信息，没有错误时返回None
+    """
+    if language == "python":
+        return check_python_syntax(code)
+    # 非Python代码在容器中统一用bash执行
+    return check_shell_syntax(code)
@@ -0,0 +1,58 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Set
+
+
+class WarmContainerPool:
+    """按用户提前启动Docker执行容器
+
+    执行容器只挂载所属用户的工作目录，运行中的容器无法更换挂载，因此容器不能在用户之间复用。
+    这里不预先启动通用容器，而是在已知某个用户即将需要容器时（例如刚提交任务、LLM还在生成第一步时）
+    在后台为该用户启动容器；之后工具第一次调用获取容器时直接使用已启动的容器，
+    启动尚未完成时等待同一次启动，不会重复创建。
+    """
+    def __init__(self, start_container: Callable[[str], Any], max_parallel_starts: int = 4):
+        """
+        Args:
+            start_container: 以用户ID为参数获取或创建该用户容器的函数
+            max_parallel_starts: 同时在后台启动的最大容器数
+        """
+        self.start_container = start_container
+        self.max_parallel_starts = max_parallel_starts
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers=max_parallel_starts,
+            thread_name_prefix="warm-container"
+        )
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def prewarm(self, user_id: str) -> bool:
+        """在后台为用户启动容器，该用户已有启动在进行中时忽略
+
+        Returns:
+            bool: 是否提交了新的后台启动
+        """
+        with self._lock:
+            if self._executor is None or user_id in self._pending:
+                return False
+            self._pending.add(user_id)
+            self._executor.submit(self._start, user_id)
+        return True
+
+    def _start(self, user_id: str) -> None:
+        try:
+            self.start_container(user_id)
+        except Exception:
+            # 预热失败不影响正常流程，工具调用时会重新创建并报告错误
+            print(f"预热用户 {user_id} 的容器失败:\n{traceback.format_exc()}")
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
+
+    def shutdown(self):
+        """停止接受新的预热请求，等待进行中的启动结束"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from docker_container import get_docker_client
+
+# 可分配给执行容器的宿主机资源比例，大于1表示允许超卖
+# 容器大部分时间空闲（等待LLM生成下一步），CPU配额只是上限，默认按4倍超卖
+DOCKER_CPU_OVERCOMMIT = float(os.getenv("DOCKER_CPU_OVERCOMMIT", "4.0"))
+DOCKER_MEMORY_OVERCOMMIT = float(os.getenv("DOCKER_MEMORY_OVERCOMMIT", "1.0"))
+# 资源不足时新容器排队等待的最长时间（秒）
+DOCKER_ADMISSION_TIMEOUT = float(os.getenv("DOCKER_ADMISSION_TIMEOUT", "60"))
+
+_admission_controller: Optional["AdmissionController"] = None
+_admission_controller_lock = threading.Lock()
+
+
+class ContainerCapacityError(RuntimeError):
+    """宿主机剩余资源不足，无法在等待时间内创建新容器"""
+
+
+class AdmissionController:
+    """按CPU和内存配额控制同时存在的执行容器
+
+    每个容器创建前按其配额预留资源，预留总量不超过宿主机容量（乘以超卖系数）；
+    资源不足时排队等待其他容器被回收释放资源，超时后拒绝。
+    未设置内存上限的容器不预留内存，只按CPU配额计入。
+    """
+    def __init__(self, cpus: float, memory: int):
+        self.cpus = cpus
+        self.memory = memory
+        self._reservations: Dict[int, Tuple[float, int]] = {}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_docker_info(cls) -> "AdmissionController":
+        """按Docker守护进程报告的CPU核数和内存总量创建"""
+        info = get_docker_client().info()
+        return cls(
+            cpus=info["NCPU"] * DOCKER_CPU_OVERCOMMIT,
+            memory=int(info["MemTotal"] * DOCKER_MEMORY_OVERCOMMIT)
+        )
+
+    @property
+    def reserved(self) -> Tuple[float, int]:
+        """已预留的(CPU核数, 内存字节数)"""
+        with self._condition:
+            return self._reserved()
+
+    def _reserved(self) -> Tuple[float, int]:
+        cpus = sum(reservation[0] for reservation in self._reservations.values())
+        memory = sum(reservation[1] for reservation in self._reservations.values())
+        return cpus, memory
+
+    def _fits(self, cpus: float, memory: int) -> bool:
+        reserved_cpus, reserved_memory = self._reserved()
+        # 没有任何预留时总是允许，避免单个容器的配额超过宿主机容量时永远无法创建
+        if not self._reservations:
+            return True
+        return reserved_cpus + cpus <= self.cpus and reserved_memory + memory <= self.memory
+
+    def try_admit(self, owner: object, cpus: float, memory: int) -> bool:
+        """资源足够时立即预留，否则返回False"""
+        with self._condition:
+            if not self._fits(cpus, memory):
+                return False
+            self._reservations[id(owner)] = (cpus, memory)
+            return True
+
+    def admit(self, owner: object, cpus: float, memory: int, timeout: float = DOCKER_ADMISSION_TIMEOUT) -> None:
+        """为容器预留资源，资源不足时最多等待timeout秒
+
+        Args:
+            owner: 占用资源的对象，通常为DockerContainer
+            cpus: CPU核数配额
+            memory: 内存配额（字节）
+            timeout: 最长等待时间（秒）
+
+        Raises:
+            ContainerCapacityError: 等待超时
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._fits(cpus, memory):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reserved_cpus, reserved_memory = self._reserved()
+                    raise ContainerCapacityError(
+                        f"宿主机资源不足: 已预留CPU {reserved_cpus:g}/{self.cpus:g}核, "
+                        f"内存 {reserved_memory >> 20}/{self.memory >> 20}MB"
+                    )
+                self._condition.wait(remaining)
+            self._reservations[id(owner)] = (cpus, memory)
+
+    def release(self, owner: object) -> None:
+        """释放容器预留的资源，唤醒排队的请求"""
+        with self._condition:
+            if self._reservations.pop(id(owner), None) is not None:
+                self._condition.notify_all()
+
+
+def get_admission_controller() -> AdmissionController:
+    """获取共享的容器准入控制器"""
+    global _admission_controller
+
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController.from_docker_info()
+
+    return _admission_controller
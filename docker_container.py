@@ -1,14 +1,419 @@
 import os
-import tempfile
+import io
+import re
+import json
+import math
+import codecs
+import shlex
+import tarfile
+import threading
 import docker
 import uuid
 import time
 import traceback
-from typing import Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from docker.utils.socket import STDOUT, next_frame_header, read_exactly
+
+from code_validation import strip_code_fences
+from code_dependencies import is_auto_install_allowed, package_name
+from image_snapshots import build_snapshot, find_snapshot, packages_hash, prune_snapshots, snapshot_tag, SNAPSHOT_REPOSITORY
+from wheelhouse import Wheelhouse, CONTAINER_WHEELHOUSE_DIR, get_wheelhouse, shared_pip_environment, shared_pip_volumes
 
 from dotenv import load_dotenv
 load_dotenv()
 
+# 容器内辅助脚本的宿主机路径和容器内安装路径
+HELPER_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docker_image")
+CONTAINER_HELPER_DIR = "/opt/agent_manus"
+KERNEL_SCRIPT_NAME = "code_kernel.py"
+
+# 每次执行报告的资源使用指标
+EXECUTION_METRICS = ("wall_time", "cpu_time", "peak_memory_kb")
+
+# 容器就绪探测：从READY_PROBE_INITIAL_DELAY秒开始指数退避，最长间隔READY_PROBE_MAX_DELAY秒
+DOCKER_START_TIMEOUT = float(os.getenv("DOCKER_START_TIMEOUT", "30"))
+READY_PROBE_INITIAL_DELAY = 0.005
+READY_PROBE_MAX_DELAY = 0.5
+
+# 每个执行容器的默认资源配额，设为空或0表示不限制
+# 内存上限默认不设置：数据分析任务常需要数GB内存，硬上限会直接OOM杀死进程，需要时再显式配置
+DOCKER_MEM_LIMIT = os.getenv("DOCKER_MEM_LIMIT", "")
+DOCKER_CPUS = float(os.getenv("DOCKER_CPUS", "1.0") or 0)
+DOCKER_PIDS_LIMIT = int(os.getenv("DOCKER_PIDS_LIMIT", "256") or 0)
+
+MEMORY_UNITS = {"b": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+# 执行超过时间限制后，再等待这么久仍未结束（例如卡在不响应信号的C扩展中）时强制结束进程
+TIMEOUT_GRACE_SECONDS = 5
+
+# 代码中包含pip安装命令时认为容器的包集合发生了变化
+PIP_INSTALL_PATTERN = re.compile(r"\bpip3?\s+install\b|\bpip\.main\(")
+
+# 在容器中检查哪些模块无法导入，输出JSON列表
+# timeout -s KILL 结束超时命令时的退出码
+PIP_TIMEOUT_EXIT_CODE = 137
+
+MISSING_MODULES_SCRIPT = (
+    "import sys, json, importlib.util\n"
+    "print(json.dumps([m for m in sys.argv[1:] if importlib.util.find_spec(m) is None]))"
+)
+
+# 共享Docker客户端的HTTP连接池大小，应不小于同时调用Docker API的线程数
+DOCKER_MAX_POOL_SIZE = int(os.getenv("DOCKER_MAX_POOL_SIZE", "64"))
+
+_docker_client: Optional[docker.DockerClient] = None
+_docker_client_lock = threading.Lock()
+
+# 快照镜像在后台依次构建，停止容器时（回收线程持有用户锁）不等待耗时的pip install
+_snapshot_executor: Optional[ThreadPoolExecutor] = None
+_snapshot_executor_lock = threading.Lock()
+
+
+def get_docker_client() -> docker.DockerClient:
+    """获取所有容器共享的Docker客户端
+
+    docker-py的客户端是线程安全的，共享一个客户端可以复用到Docker守护进程的连接，
+    避免每次启动容器都重新创建客户端和连接池。
+    """
+    global _docker_client
+
+    with _docker_client_lock:
+        if _docker_client is None:
+            _docker_client = docker.from_env(max_pool_size=DOCKER_MAX_POOL_SIZE)
+
+    return _docker_client
+
+
+def _get_snapshot_executor() -> ThreadPoolExecutor:
+    global _snapshot_executor
+
+    with _snapshot_executor_lock:
+        if _snapshot_executor is None:
+            _snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="docker-snapshot")
+
+    return _snapshot_executor
+
+
+def wait_for_snapshot_builds() -> None:
+    """等待后台进行中的快照构建完成"""
+    global _snapshot_executor
+
+    with _snapshot_executor_lock:
+        executor, _snapshot_executor = _snapshot_executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def save_snapshot(base_image: str, user_id: str, freeze_output: str) -> str:
+    """从基础镜像构建用户的快照镜像，安装 pip freeze 列出的包
+
+    快照按包内容哈希命名，包集合没有变化时不重复构建。
+
+    Returns:
+        str: 快照镜像名称
+    """
+    image_name = f"{SNAPSHOT_REPOSITORY}:{snapshot_tag(user_id, packages_hash(freeze_output))}"
+    client = get_docker_client()
+    try:
+        client.images.get(image_name)
+        return image_name
+    except docker.errors.ImageNotFound:
+        pass
+
+    # 从基础镜像重新构建，而不是提交容器，避免快照在旧快照上层层叠加
+    build_snapshot(client, base_image, user_id, freeze_output)
+    print(f"保存快照镜像 {image_name}")
+    return image_name
+
+
+def _save_snapshot_and_prune(base_image: str, user_id: str, freeze_output: str) -> None:
+    """后台构建快照并清理用户的旧快照，正在被新容器使用的旧快照删除失败时留给定期清理"""
+    try:
+        save_snapshot(base_image, user_id, freeze_output)
+    except Exception as e:
+        print(f"保存快照镜像失败: {str(e)}")
+        return
+    try:
+        prune_snapshots(get_docker_client(), user_id)
+    except Exception as e:
+        print(f"清理快照镜像失败: {str(e)}")
+
+
+def close_docker_client() -> None:
+    """关闭共享的Docker客户端及其连接池"""
+    global _docker_client
+
+    with _docker_client_lock:
+        if _docker_client is not None:
+            _docker_client.close()
+            _docker_client = None
+
+
+def parse_memory(value) -> int:
+    """把 "512m"、"2g" 这样的内存配额转换为字节数，空值返回0"""
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+    value = value.strip().lower().rstrip("b") or "0"
+    if value[-1] in MEMORY_UNITS:
+        return int(float(value[:-1]) * MEMORY_UNITS[value[-1]])
+    return int(value)
+
+
+def build_execution_result(
+    stdout: str,
+    stderr: str,
+    exit_code: int,
+    error: str = "",
+    metrics: Optional[Dict] = None
+) -> Dict:
+    """把一次执行的输出和退出信息汇总为结果
+
+    Args:
+        stdout: 标准输出
+        stderr: 标准错误输出，执行成功时也会保留（例如警告信息）
+        exit_code: 进程退出码
+        error: 执行过程本身的错误信息，例如容器调用失败
+        metrics: 执行的资源使用情况（wall_time、cpu_time、peak_memory_kb）
+
+    Returns:
+        Dict包含success、output、error、exit_code字段以及资源使用情况
+    """
+    success = exit_code == 0 and not error
+    result = {
+        "success": success,
+        "output": stdout if stdout or not success else "代码执行成功",
+        "error": stderr + error,
+        "exit_code": exit_code
+    }
+    result.update(metrics or {})
+    return result
+
+
+class ExecChannel:
+    """与容器内 code_kernel.py 进程之间的通信通道
+
+    通过 docker exec 的原始套接字交换JSON行协议消息：stdout帧承载协议消息，
+    stderr帧是进程直接写出的原始输出。
+    """
+    def __init__(self, container, command: List[str], work_dir: str, environment: Optional[Dict[str, str]] = None):
+        self.container = container
+        self.command = command
+        self.work_dir = work_dir
+        self.environment = environment
+        self._socket = None
+        self._buffer = b""
+        self._stderr_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def open(self) -> bool:
+        return self._socket is not None
+
+    def start(self):
+        """创建exec实例并连接到其stdin/stdout"""
+        api = self.container.client.api
+        exec_id = api.exec_create(
+            self.container.id,
+            self.command,
+            stdin=True,
+            workdir=self.work_dir,
+            environment=self.environment
+        )["Id"]
+        self._socket = api.exec_start(exec_id, socket=True)
+        return self
+
+    def send(self, data: bytes) -> None:
+        raw_socket = getattr(self._socket, "_sock", self._socket)
+        raw_socket.sendall(data)
+
+    def read_message(self, stray_output: Optional[List[str]] = None) -> Optional[dict]:
+        """读取下一条协议消息，stderr上的原始输出追加到stray_output中
+
+        Returns:
+            dict: 协议消息，连接关闭时返回None
+        """
+        while b"\n" not in self._buffer:
+            stream, size = next_frame_header(self._socket)
+            if size < 0:
+                return None
+            data = read_exactly(self._socket, size)
+            if stream == STDOUT:
+                self._buffer += data
+            elif stray_output is not None:
+                text = self._stderr_decoder.decode(data)
+                if text:
+                    stray_output.append(text)
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line.decode("utf-8"))
+
+    def close(self) -> None:
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except Exception:
+                pass
+            self._socket = None
+
+
+class PythonKernel:
+    """容器内常驻的Python内核，按任务保留执行状态
+
+    通过 docker exec 启动 code_kernel.py 并保持 stdin/stdout 连接，
+    同一任务的多次执行共享全局变量、已导入的模块和已加载的数据。
+    """
+    def __init__(self, container, session_id: str, work_dir: str):
+        self.container = container
+        self.session_id = session_id
+        self.work_dir = work_dir
+        self.pid = None
+        # 已获取该内核、尚未执行完成的调用数，大于0时不会被LRU淘汰
+        self.users = 0
+        self._channel = ExecChannel(
+            container,
+            ["python", "-u", f"{CONTAINER_HELPER_DIR}/{KERNEL_SCRIPT_NAME}", "serve"],
+            work_dir,
+            environment={"MPLBACKEND": "Agg"}
+        )
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self._channel.open
+
+    def start(self):
+        """在容器中启动内核进程并等待就绪"""
+        self._channel.start()
+        message = self._channel.read_message()
+        if message is None or message.get("type") != "ready":
+            self.close()
+            raise RuntimeError(f"内核启动失败: {self.session_id}")
+        self.pid = message.get("pid")
+        return self
+
+    def execute_stream(
+        self,
+        code: str,
+        work_dir: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None
+    ) -> Iterator[Dict]:
+        """在内核中执行代码并逐块返回输出
+
+        Args:
+            code: 要执行的Python代码
+            work_dir: 执行代码的工作目录，如果不提供则使用内核启动时的目录
+            timeout: 墙钟时间限制（秒），超时后执行被中断，内核及其状态保留
+            cpu_timeout: CPU时间限制（秒）
+
+        Yields:
+            {"type": "stdout"/"stderr", "text": ...}，最后一个事件为
+            {"type": "exit", "exit_code": ..., "error": ..., "timed_out": ..., "wall_time": ..., "cpu_time": ..., "peak_memory_kb": ...}
+        """
+        with self._lock:
+            if not self.alive:
+                raise RuntimeError(f"内核未启动: {self.session_id}")
+
+            request = {
+                "id": uuid.uuid4().hex,
+                "code": code,
+                "work_dir": work_dir or self.work_dir,
+                "timeout": timeout,
+                "cpu_timeout": cpu_timeout
+            }
+            self._channel.send((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+
+            finished = False
+            try:
+                for event in _iter_channel_events(self._channel, request["id"]):
+                    if event["type"] == "exit":
+                        finished = True
+                        if event["exit_code"] == -1:
+                            self.close()
+                    yield event
+            finally:
+                # 调用方提前停止读取时，剩余输出无法再同步，直接结束内核进程
+                if not finished and self.alive:
+                    self.kill()
+
+    def interrupt(self) -> None:
+        """中断当前执行，内核及其状态保留"""
+        if self.pid:
+            self.container.exec_run(["sh", "-c", f"kill -INT {self.pid}"])
+
+    def kill(self) -> None:
+        """强制结束内核进程"""
+        if self.pid:
+            try:
+                self.container.exec_run(["sh", "-c", f"kill -KILL {self.pid}"])
+            except Exception:
+                pass
+        self.close()
+
+    def close(self):
+        """关闭连接，内核进程读到EOF后自行退出"""
+        self._channel.close()
+
+
+def _iter_channel_events(channel: ExecChannel, request_id: Optional[str] = None) -> Iterator[Dict]:
+    """把通道中的协议消息转换为执行事件，直到收到result消息或连接关闭"""
+    while True:
+        stray_output: List[str] = []
+        message = channel.read_message(stray_output)
+        for text in stray_output:
+            yield {"type": "stderr", "text": text}
+        if message is None:
+            yield {"type": "exit", "exit_code": -1, "error": "\n执行进程意外退出"}
+            return
+        if message.get("id") != request_id:
+            continue
+        if message["type"] == "stream":
+            yield {"type": message["name"], "text": message["text"]}
+        elif message["type"] == "result":
+            yield {
+                "type": "exit",
+                "exit_code": message["exit_code"],
+                "error": message.get("error", ""),
+                "timed_out": message.get("timed_out", False),
+                "wall_time": message.get("wall_time"),
+                "cpu_time": message.get("cpu_time"),
+                "peak_memory_kb": message.get("peak_memory_kb")
+            }
+            return
+
+
+def _watch_timeout(events: Iterator[Dict], timeout: Optional[float], on_expire: Callable[[], None]) -> Iterator[Dict]:
+    """执行进程超过timeout后仍未自行结束时调用on_expire强制结束，并把结果标记为超时"""
+    if not timeout:
+        yield from events
+        return
+
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        on_expire()
+
+    timer = threading.Timer(timeout + TIMEOUT_GRACE_SECONDS, expire)
+    timer.daemon = True
+    timer.start()
+    error = f"\n执行时间超过 {timeout} 秒，进程已被强制结束"
+    try:
+        for event in events:
+            if event["type"] == "exit" and expired.is_set():
+                event = {**event, "timed_out": True, "error": error}
+            yield event
+    except Exception:
+        # 强制结束进程时连接可能在读取过程中被关闭
+        if not expired.is_set():
+            raise
+        yield {"type": "exit", "exit_code": -1, "error": error, "timed_out": True}
+    finally:
+        timer.cancel()
+
+
 class DockerContainer:
     """管理Docker容器的简单类"""
     def __init__(
@@ -16,7 +421,13 @@ class DockerContainer:
         image: str = "python_code_executor:3.11",
         container_name: str = "llamaindex-executor",
         base_work_dir: str = "/Users/pingcy/workspace",
-        auto_remove: bool = True
+        auto_remove: bool = True,
+        use_kernel: bool = True,
+        max_kernels: int = 4,
+        snapshot_user: Optional[str] = None,
+        mem_limit: Optional[str] = DOCKER_MEM_LIMIT,
+        cpus: Optional[float] = DOCKER_CPUS,
+        pids_limit: Optional[int] = DOCKER_PIDS_LIMIT
     ):
         self.image = image
         self.container_name = container_name
@@ -24,10 +435,38 @@ class DockerContainer:
         self.auto_remove = auto_remove
         self.container = None
         self.current_work_dir = base_work_dir
+        # 按会话（任务）保存的常驻Python内核，超出上限时关闭最久未使用的
+        self.use_kernel = use_kernel
+        self.max_kernels = max_kernels
+        self.kernels: "OrderedDict[str, PythonKernel]" = OrderedDict()
+        self._kernels_lock = threading.Lock()
+        # 使用情况，供空闲回收判断
+        self.last_used = time.time()
+        self.active_executions = 0
+        self._usage_lock = threading.Lock()
+        # 可取消的执行（按执行ID组织）
+        self._cancellers: Dict[str, Callable[[], None]] = {}
+        self._cancellers_lock = threading.Lock()
+        # 已确认可导入的模块与安装失败的模块，避免每次执行都检查或重复安装
+        self._available_modules: Set[str] = set()
+        self._failed_modules: Set[str] = set()
+        self._packages_lock = threading.Lock()
+        # 资源配额，避免单个用户的任务占满宿主机
+        self.mem_limit = mem_limit or None
+        self.cpus = cpus or None
+        self.pids_limit = pids_limit or None
+        # 设置用户ID时，停止容器前把安装过的包保存为该用户的快照镜像，下次从快照启动
+        self.snapshot_user = snapshot_user
+        self.packages_changed = False
+        # 挂载了共享wheel仓库时用于离线安装
+        self._wheelhouse: Optional[Wheelhouse] = None
+        # 最近一次start()从请求到容器可执行命令的耗时（秒）
+        self.start_latency: Optional[float] = None
         
     def start(self):
         """启动Docker容器"""
-        client = docker.from_env()
+        client = get_docker_client()
+        started_at = time.perf_counter()
         
         try:
             # 尝试获取现有容器
@@ -39,43 +478,319 @@ class DockerContainer:
                 else:
                     print(f"使用运行中容器 {self.container_name}")
             except docker.errors.NotFound:
+                # 用户有快照镜像时从快照启动，之前安装的包无需重新安装
+                image = self.image
+                snapshot = find_snapshot(client, self.snapshot_user) if self.snapshot_user else None
+                if snapshot is not None:
+                    image = snapshot.id
+                    print(f"从快照镜像启动 {snapshot.tags[0] if snapshot.tags else snapshot.id}")
+                
                 # 创建新容器时增加超时和重试机制
                 self.container = client.containers.run(
-                    self.image,
+                    image,
                     command="tail -f /dev/null", # 保持容器运行
                     detach=True,
                     working_dir=self.base_work_dir,
                     name=self.container_name,
                     auto_remove=self.auto_remove,
-                    volumes={self.base_work_dir: {'bind': self.base_work_dir, 'mode': 'rw'}},
-                    healthcheck={
-                        'test': ['CMD-SHELL', 'echo ready'],
-                        'interval': 1000000000
+                    # 禁用swap，内存超出配额时由OOM终止容器内进程
+                    mem_limit=self.mem_limit,
+                    memswap_limit=self.mem_limit,
+                    nano_cpus=int(self.cpus * 1e9) if self.cpus else None,
+                    pids_limit=self.pids_limit,
+                    volumes={
+                        self.base_work_dir: {'bind': self.base_work_dir, 'mode': 'rw'},
+                        # 所有执行容器只读共享本地wheel仓库
+                        **shared_pip_volumes()
                     },
                     environment={
                         'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY', ''),
-                        'OPENAI_BASE_URL': os.getenv('OPENAI_BASE_URL', '')
+                        'OPENAI_BASE_URL': os.getenv('OPENAI_BASE_URL', ''),
+                        **shared_pip_environment()
                     }
                 )
                 print(f"创建新容器 {self.container_name}")
-                
-                # 等待容器健康状态
-                for _ in range(10):
-                    self.container.reload()
-                    if self.container.attrs['State']['Health']['Status'] == 'healthy':
-                        break
-                    time.sleep(1)
-                else:
-                    raise RuntimeError("容器启动超时")
+
+            self._wait_until_ready()
+            self._install_helpers()
+            self._wheelhouse = get_wheelhouse() if self._has_mount(CONTAINER_WHEELHOUSE_DIR) else None
         except Exception as e:
             print(f"容器操作失败详情:\n{traceback.format_exc()}")
             raise RuntimeError(f"启动Docker容器失败: {str(e)}")
             
+        self.start_latency = time.perf_counter() - started_at
+        print(f"容器 {self.container_name} 就绪，耗时 {self.start_latency * 1000:.0f}ms")
         return self
+
+    @property
+    def resources(self) -> Dict:
+        """容器的资源配额"""
+        return {"mem_limit": self.mem_limit, "cpus": self.cpus, "pids_limit": self.pids_limit}
+
+    def _wait_until_ready(self, timeout: float = DOCKER_START_TIMEOUT) -> None:
+        """用exec探测容器是否可以执行命令，探测间隔从几毫秒开始指数退避"""
+        deadline = time.perf_counter() + timeout
+        delay = READY_PROBE_INITIAL_DELAY
+        while True:
+            try:
+                if self.container.exec_run(["true"]).exit_code == 0:
+                    return
+            except docker.errors.APIError:
+                # 容器尚未进入running状态时exec会返回409
+                pass
+            if time.perf_counter() >= deadline:
+                raise RuntimeError("容器启动超时")
+            time.sleep(delay)
+            delay = min(delay * 2, READY_PROBE_MAX_DELAY)
+
+    def _has_mount(self, destination: str) -> bool:
+        """容器是否挂载了指定路径，之前创建的容器可能没有新增的挂载"""
+        mounts = self.container.attrs.get("Mounts") or []
+        return any(mount.get("Destination") == destination for mount in mounts)
+
+    def _install_helpers(self) -> None:
+        """把容器内辅助脚本复制到容器中，无需重新构建镜像"""
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            dir_info = tarfile.TarInfo(CONTAINER_HELPER_DIR.lstrip("/"))
+            dir_info.type = tarfile.DIRTYPE
+            dir_info.mode = 0o755
+            tar.addfile(dir_info)
+            tar.add(
+                os.path.join(HELPER_SOURCE_DIR, KERNEL_SCRIPT_NAME),
+                arcname=f"{CONTAINER_HELPER_DIR.lstrip('/')}/{KERNEL_SCRIPT_NAME}"
+            )
+        self.container.put_archive("/", archive.getvalue())
+
+    def get_kernel(self, session_id: str, work_dir: Optional[str] = None) -> PythonKernel:
+        """获取会话对应的常驻内核，不存在或已退出时启动新内核
+
+        获取后内核标记为使用中，执行结束后必须调用release_kernel。
+        内核数量达到上限时关闭最久未使用的空闲内核；正在执行的内核不会被关闭，
+        全部内核都在执行时暂时超出上限。
+        
+        Args:
+            session_id: 会话ID（通常为任务ID）
+            work_dir: 内核启动时的工作目录
+        """
+        with self._kernels_lock:
+            kernel = self.kernels.get(session_id)
+            if kernel is not None and kernel.alive:
+                self.kernels.move_to_end(session_id)
+                kernel.users += 1
+                return kernel
+
+            self.kernels.pop(session_id, None)
+            idle = [sid for sid, stale_kernel in self.kernels.items() if stale_kernel.users == 0]
+            for sid in idle[:max(0, len(self.kernels) - self.max_kernels + 1)]:
+                self.kernels.pop(sid).close()
+
+            kernel = PythonKernel(self.container, session_id, work_dir or self.current_work_dir).start()
+            kernel.users = 1
+            self.kernels[session_id] = kernel
+            print(f"启动内核 {session_id} (pid={kernel.pid})")
+            return kernel
+
+    def release_kernel(self, kernel: PythonKernel) -> None:
+        """执行结束，内核不再处于使用中"""
+        with self._kernels_lock:
+            kernel.users -= 1
+
+    def close_kernel(self, session_id: str) -> None:
+        """关闭指定会话的常驻内核"""
+        with self._kernels_lock:
+            kernel = self.kernels.pop(session_id, None)
+        if kernel:
+            kernel.close()
+
+    def close_all_kernels(self) -> None:
+        """关闭容器中的所有常驻内核"""
+        with self._kernels_lock:
+            kernels = list(self.kernels.values())
+            self.kernels.clear()
+        for kernel in kernels:
+            kernel.close()
     
+    def install_missing_packages(
+        self,
+        modules: Iterable[str],
+        work_dir: Optional[str] = None,
+        timeout: Optional[float] = None
+    ) -> Tuple[List[str], str]:
+        """安装容器中缺失的Python模块
+
+        已确认存在或安装失败过的模块会被缓存，只检查新出现的模块；检查不持有安装锁，
+        只有确实需要安装时才与同一容器的其他安装串行；
+        只安装自动安装允许列表中或本地wheel仓库中已有的包，其他包不安装并在错误信息中说明。
+        缺失的包先在一次pip调用中安装，由pip统一解析依赖，失败时再逐个安装。
+
+        Args:
+            modules: 代码导入的顶层模块名
+            work_dir: 检查模块时的工作目录，工作目录下的本地模块视为已存在
+            timeout: 所有pip调用合计的最长时间（秒），不提供时不限制
+
+        Returns:
+            (安装成功的pip包名列表, 安装失败时的错误信息)
+        """
+        if not self.container:
+            self.start()
+
+        deadline = time.monotonic() + timeout if timeout else None
+        # 先不加锁检查缺失的模块，不需要安装时不会被同一用户正在进行的安装阻塞
+        unknown = sorted(set(modules) - self._available_modules - self._failed_modules)
+        if not unknown:
+            return [], ""
+        missing, error = self._find_missing_modules(unknown, work_dir)
+        if error:
+            return [], error
+        self._available_modules.update(set(unknown) - set(missing))
+        if not missing:
+            return [], ""
+
+        with self._packages_lock:
+            # 等待锁期间其他执行可能已经安装或确认安装失败
+            missing = [
+                module for module in missing
+                if module not in self._available_modules and module not in self._failed_modules
+            ]
+            if not missing:
+                return [], ""
+
+            errors = []
+            rejected = [module for module in missing if not self._install_allowed(package_name(module))]
+            if rejected:
+                self._failed_modules.update(rejected)
+                errors.append(
+                    f"未自动安装不在允许列表中的包: {' '.join(package_name(module) for module in rejected)}\n"
+                )
+                missing = [module for module in missing if module not in rejected]
+            if not missing:
+                return [], "".join(errors)
+
+            print(f"容器 {self.container_name} 安装缺失的包: {' '.join(package_name(module) for module in missing)}")
+            exit_code, output = self._pip_install([package_name(module) for module in missing], deadline)
+            if exit_code == 0:
+                self._available_modules.update(missing)
+                self.packages_changed = True
+                return [package_name(module) for module in missing], "".join(errors)
+
+            if len(missing) == 1:
+                self._failed_modules.update(missing)
+                return [], "".join(errors) + output
+
+            # 一个包安装失败会导致整批失败，逐个重试以安装其余的包
+            installed = []
+            for module in missing:
+                exit_code, output = self._pip_install([package_name(module)], deadline)
+                if exit_code == 0:
+                    self._available_modules.add(module)
+                    self.packages_changed = True
+                    installed.append(package_name(module))
+                else:
+                    self._failed_modules.add(module)
+                    errors.append(output)
+            return installed, "".join(errors)
+
+    def _find_missing_modules(self, modules: List[str], work_dir: Optional[str]) -> Tuple[List[str], str]:
+        """在容器中检查哪些模块无法导入
+
+        Returns:
+            (缺失的模块列表, 检查失败时的错误信息)
+        """
+        try:
+            exit_code, output = self.container.exec_run(
+                ["python", "-c", MISSING_MODULES_SCRIPT, *modules],
+                workdir=work_dir
+            )
+        except docker.errors.APIError as e:
+            return [], f"检查缺失的包失败: {str(e)}\n"
+        output = output.decode("utf-8", errors="replace")
+        if exit_code != 0:
+            return [], output
+        # 输出中可能混有导入模块时打印的警告，结果在最后一行
+        lines = output.strip().splitlines()
+        try:
+            missing = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            missing = None
+        if not isinstance(missing, list):
+            return [], f"检查缺失的包失败，无法解析输出: {output.strip()}\n"
+        return missing, ""
+
+    def _install_allowed(self, package: str) -> bool:
+        """允许列表中的包，或本地wheel仓库中已有（之前审核并下载过）的包可以自动安装"""
+        if is_auto_install_allowed(package):
+            return True
+        return self._wheelhouse is not None and self._wheelhouse.available([package])
+
+    def _pip_install(self, packages: List[str], deadline: Optional[float] = None) -> Tuple[int, str]:
+        """安装pip包
+
+        挂载了共享wheel仓库时，仓库中没有的包先由宿主机启动的构建容器下载到仓库并记录到清单，
+        再在执行容器中用 --no-index 从仓库离线安装；执行容器自身不能写入仓库。
+        """
+        pip = ["python", "-m", "pip", "--disable-pip-version-check"]
+        if self._wheelhouse is None:
+            return self._exec_output(pip + ["install", "--quiet", *packages], deadline=deadline)
+
+        environment = shared_pip_environment()
+        offline_install = pip + ["install", "--quiet", "--no-index", "--find-links", CONTAINER_WHEELHOUSE_DIR, *packages]
+        if self._wheelhouse.available(packages):
+            exit_code, output = self._exec_output(offline_install, environment, deadline)
+            if exit_code == 0:
+                return exit_code, output
+            # 清单与仓库中的文件不一致时重新下载
+
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return PIP_TIMEOUT_EXIT_CODE, "pip安装超时，已跳过\n"
+        exit_code, output = self._wheelhouse.build(get_docker_client(), self.image, packages, timeout)
+        if exit_code != 0:
+            return exit_code, output
+        return self._exec_output(offline_install, environment, deadline)
+
+    def _exec_output(
+        self,
+        command: List[str],
+        environment: Optional[Dict[str, str]] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[int, str]:
+        """在容器中运行命令，提供deadline时超过截止时间后用timeout结束命令"""
+        if deadline is not None:
+            remaining = math.ceil(deadline - time.monotonic())
+            if remaining <= 0:
+                return PIP_TIMEOUT_EXIT_CODE, "pip安装超时，已跳过\n"
+            command = ["timeout", "-s", "KILL", str(remaining), *command]
+        exit_code, output = self.container.exec_run(command, environment=environment)
+        output = output.decode("utf-8", errors="replace")
+        if deadline is not None and exit_code == PIP_TIMEOUT_EXIT_CODE:
+            output += "pip安装超时，已被终止\n"
+        return exit_code, output
+
+    @property
+    def busy(self) -> bool:
+        """容器是否有正在进行的执行"""
+        return self.active_executions > 0
+
+    def acquire(self) -> None:
+        """标记开始使用容器，使用中的容器不会被回收"""
+        with self._usage_lock:
+            self.active_executions += 1
+            self.last_used = time.time()
+
+    def release(self) -> None:
+        """标记结束使用容器"""
+        with self._usage_lock:
+            self.active_executions = max(0, self.active_executions - 1)
+            self.last_used = time.time()
+
     def set_work_dir(self, work_dir: str) -> None:
         """设置当前工作目录
         
+        会修改容器共享的当前目录，同一容器并发执行多个任务时应改为在execute中按调用传入work_dir。
+        
         Args:
             work_dir: 新的工作目录
         """
@@ -86,79 +801,231 @@ class DockerContainer:
         if self.container:
             self.container.exec_run(f"mkdir -p {work_dir}")
         
+    def _freeze_packages(self) -> str:
+        """返回容器中 pip freeze 的输出"""
+        exit_code, output = self.container.exec_run(["python", "-m", "pip", "freeze", "--disable-pip-version-check"])
+        output = output.decode("utf-8", errors="replace")
+        if exit_code != 0:
+            raise RuntimeError(f"获取已安装包失败: {output}")
+        return output
+
+    def snapshot(self) -> Optional[str]:
+        """把容器当前安装的包保存为用户的快照镜像，等待构建完成
+
+        Returns:
+            str: 快照镜像名称，未设置snapshot_user时返回None
+        """
+        if not self.container or not self.snapshot_user:
+            return None
+        return save_snapshot(self.image, self.snapshot_user, self._freeze_packages())
+
     def stop(self):
-        """停止Docker容器"""
+        """停止Docker容器
+
+        安装过新包时先记录容器中的包列表，容器停止后在后台构建快照镜像并清理旧快照。
+        """
+        self.close_all_kernels()
         if self.container and self.auto_remove:
+            freeze_output = None
+            if self.snapshot_user and self.packages_changed:
+                try:
+                    freeze_output = self._freeze_packages()
+                except Exception as e:
+                    print(f"保存快照镜像失败: {str(e)}")
             print(f"停止容器 {self.container_name}")
             self.container.stop()
             self.container = None
+            # 快照从基础镜像构建，不依赖已停止的容器；容器停止后其使用的旧快照才能删除
+            if freeze_output is not None:
+                _get_snapshot_executor().submit(_save_snapshot_and_prune, self.image, self.snapshot_user, freeze_output)
             
-    def execute(self, code: str, language: str = "python", work_dir: Optional[str] = None) -> Dict[str, str]:
-        """在Docker容器中执行代码
-        
+    def cancel(self, execution_id: str) -> bool:
+        """取消正在进行的执行
+
+        Args:
+            execution_id: 调用execute_stream时提供的执行ID
+
+        Returns:
+            bool: 是否找到并取消了该执行
+        """
+        with self._cancellers_lock:
+            canceller = self._cancellers.get(execution_id)
+        if canceller is None:
+            return False
+        canceller()
+        return True
+
+    def _register_canceller(self, execution_id: Optional[str], canceller: Callable[[], None]) -> None:
+        if execution_id:
+            with self._cancellers_lock:
+                self._cancellers[execution_id] = canceller
+
+    def _unregister_canceller(self, execution_id: Optional[str]) -> None:
+        if execution_id:
+            with self._cancellers_lock:
+                self._cancellers.pop(execution_id, None)
+
+    def execute_stream(
+        self,
+        code: str,
+        language: str = "python",
+        work_dir: Optional[str] = None,
+        session_id: Optional[str] = None,
+        execution_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None
+    ) -> Iterator[Dict]:
+        """在Docker容器中执行代码并逐块返回输出
+
+        调用方提前关闭生成器时会终止正在执行的进程。超过timeout或cpu_timeout时执行被终止，
+        exit事件中timed_out为True；进程不响应时超时TIMEOUT_GRACE_SECONDS秒后被强制结束，
+        常驻内核此时会被关闭，下次执行时重新启动。
+
         Args:
             code: 要执行的代码
             language: 代码语言，支持 "python", "sh", "bash"
             work_dir: 执行代码的工作目录，如果不提供则使用当前工作目录
-            
-        Returns:
-            Dict包含output和error字段
+            session_id: 会话ID，提供时Python代码在该会话的常驻内核中执行，状态在多次执行间保留
+            execution_id: 执行ID，提供时可通过cancel取消该执行
+            timeout: 墙钟时间限制（秒），不提供时不限制
+            cpu_timeout: CPU时间限制（秒），不提供时不限制
+
+        Yields:
+            {"type": "stdout"/"stderr", "text": ...}，最后一个事件为 {"type": "exit", "exit_code": ..., "error": ..., "timed_out": ...}
         """
         if not self.container:
             self.start()
         
         # 使用指定工作目录或当前工作目录
         execution_dir = work_dir if work_dir else self.current_work_dir
-        
-        result = {"output": "", "error": ""}
-        temp_file = None
+
+        #取出多余的md符号，比如```python,或者```shell，或者```bash，或者```sh，或者```
+        code = strip_code_fences(code, language)
+        if PIP_INSTALL_PATTERN.search(code):
+            self.packages_changed = True
+
+        if language == "python" and session_id and self.use_kernel:
+            try:
+                kernel = self.get_kernel(session_id, execution_dir)
+            except Exception as e:
+                # 内核不可用时退回一次性执行
+                print(f"内核启动失败，改为一次性执行: {str(e)}")
+            else:
+                self._register_canceller(execution_id, kernel.interrupt)
+                try:
+                    yield from _watch_timeout(
+                        kernel.execute_stream(code, execution_dir, timeout, cpu_timeout),
+                        timeout,
+                        kernel.kill
+                    )
+                except Exception as e:
+                    self.close_kernel(session_id)
+                    yield {"type": "exit", "exit_code": -1, "error": str(e)}
+                finally:
+                    self._unregister_canceller(execution_id)
+                    self.release_kernel(kernel)
+                return
+
+        yield from self._execute_once_stream(code, language, execution_dir, execution_id, timeout, cpu_timeout)
+
+    def _execute_once_stream(
+        self,
+        code: str,
+        language: str,
+        execution_dir: str,
+        execution_id: Optional[str],
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None
+    ) -> Iterator[Dict]:
+        """启动新进程执行代码，代码通过exec的stdin传入容器，不在宿主机上写临时文件"""
+        # 容器内的临时文件和进程命令行都包含tag，取消时据此查找进程
+        tag = uuid.uuid4().hex
+        finished = False
+        channel = None
         
         try:
-            # 根据语言选择文件后缀和执行命令
-            file_suffix = ".py" if language == "python" else ".sh"
+            channel = ExecChannel(
+                self.container,
+                ["python", "-u", f"{CONTAINER_HELPER_DIR}/{KERNEL_SCRIPT_NAME}", "run", language, tag],
+                execution_dir
+            ).start()
+            self._register_canceller(execution_id, lambda: self._kill_processes(tag))
             
-            #取出多余的md符号，比如```python,或者```shell，或者```bash，或者```sh，或者```
-            code = code.replace("```python", "").replace("```shell", "").replace("```bash", "").replace("```sh", "").replace("```", "")
+            request = {"id": tag, "code": code, "work_dir": execution_dir, "timeout": timeout, "cpu_timeout": cpu_timeout}
+            channel.send((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
             
-            # 将代码写入临时文件
-            with tempfile.NamedTemporaryFile(mode='w', suffix=file_suffix, dir=execution_dir, delete=False) as f:
-                f.write(code)
-                temp_file = f.name
-                
-            if language == "python":
-                execute_cmd = f"python {temp_file}"
-            else:
-                # 为shell脚本添加执行权限
-                os.chmod(temp_file, 0o755)
-                execute_cmd = f"bash {temp_file}"
-                
-            # 在容器中执行代码
-            exit_code, output = self.container.exec_run(
-                execute_cmd,
-                workdir=execution_dir
-            )
-            
-            output_str = output.decode('utf-8')
-            
-            if exit_code != 0:
-                result["error"] = output_str
-            else:
-                if output_str:
-                    result["output"] = output_str
-                else:
-                    result["output"] = "代码执行成功"
+            events = _iter_channel_events(channel, tag)
+            for event in _watch_timeout(events, timeout, lambda: self._kill_processes(tag, "KILL")):
+                if event["type"] == "exit":
+                    finished = True
+                yield event
                 
         except Exception as e:
-            result["error"] = str(e)
+            finished = True
+            yield {"type": "exit", "exit_code": -1, "error": str(e)}
             
         finally:
-            # 清理临时文件
-            if temp_file and os.path.exists(temp_file):
-                os.unlink(temp_file)
+            self._unregister_canceller(execution_id)
+            if channel is not None:
+                channel.close()
+            # 调用方提前停止读取时终止进程
+            if not finished:
+                self._kill_processes(tag)
+
+    def _kill_processes(self, pattern: str, sig: str = "TERM") -> None:
+        """向容器中命令行包含pattern的进程发送信号"""
+        # 脚本本身的命令行也包含pattern，需要跳过自身($$)，否则可能在找到目标进程前先杀死自己
+        script = (
+            "for p in /proc/[0-9]*; do "
+            "pid=${p#/proc/}; [ \"$pid\" = \"$$\" ] && continue; "
+            f"if grep -qF {shlex.quote(pattern)} $p/cmdline 2>/dev/null; then kill -{sig} $pid; fi; "
+            "done"
+        )
+        try:
+            self.container.exec_run(["sh", "-c", script])
+        except Exception as e:
+            print(f"终止进程失败: {str(e)}")
+
+    def execute(
+        self,
+        code: str,
+        language: str = "python",
+        work_dir: Optional[str] = None,
+        session_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None
+    ) -> Dict[str, str]:
+        """在Docker容器中执行代码
         
+        Args:
+            code: 要执行的代码
+            language: 代码语言，支持 "python", "sh", "bash"
+            work_dir: 执行代码的工作目录，如果不提供则使用当前工作目录
+            session_id: 会话ID，提供时Python代码在该会话的常驻内核中执行，状态在多次执行间保留
+            timeout: 墙钟时间限制（秒），不提供时不限制
+            cpu_timeout: CPU时间限制（秒），不提供时不限制
+            
+        Returns:
+            Dict包含success、output(stdout)、error(stderr)、exit_code、timed_out字段以及资源使用情况
+        """
+        stdout: List[str] = []
+        stderr: List[str] = []
+        exit_event: Dict = {"exit_code": -1, "error": ""}
+        for event in self.execute_stream(code, language, work_dir, session_id, timeout=timeout, cpu_timeout=cpu_timeout):
+            if event["type"] == "exit":
+                exit_event = event
+            else:
+                (stdout if event["type"] == "stdout" else stderr).append(event["text"])
+        result = build_execution_result(
+            "".join(stdout),
+            "".join(stderr),
+            exit_event["exit_code"],
+            exit_event["error"],
+            {key: exit_event.get(key) for key in EXECUTION_METRICS}
+        )
+        result["timed_out"] = exit_event.get("timed_out", False)
         return result
 
-
 if __name__ == '__main__':
     def convert_to_escaped_string(code):
         # 转义单引号和反斜杠
@@ -0,0 +1,383 @@
+"""容器内的代码执行辅助脚本
+
+由宿主机通过 docker exec 启动，支持两种模式:
+
+    serve                     常驻内核模式，保持 stdin 连接，在同一任务的多次执行之间
+                              保留全局变量、已导入的模块和已加载的数据。
+                              宿主机向内核进程发送 SIGINT 可中断当前执行，内核和已有状态保留。
+    run <language> <tag>      一次性执行模式，从 stdin 读取一条请求，把代码写入容器内的临时文件
+                              （文件名包含 tag，便于宿主机按 tag 取消），在子进程中运行并转发其输出。
+
+两种模式使用相同的通信协议（每行一个JSON）:
+    宿主机 -> 内核 (stdin):  {"id": "...", "code": "...", "work_dir": "...", "timeout": 60, "cpu_timeout": 30}
+    内核 -> 宿主机 (stdout): {"type": "ready", "pid": 123}
+                             {"type": "stream", "id": "...", "name": "stdout", "text": "..."}
+                             {"type": "result", "id": "...", "exit_code": 0, "error": "", "timed_out": false,
+                              "wall_time": 0.1, "cpu_time": 0.05, "peak_memory_kb": 20480}
+
+timeout 为墙钟时间限制，cpu_timeout 为CPU时间限制（秒），不提供时不限制。
+超时的执行退出码为 TIMEOUT_EXIT_CODE（常驻内核）或被信号终止（一次性执行），timed_out 为 true。
+
+用户代码的输出通过 stream 消息转发；子进程直接写入的原始输出会被重定向到 stderr。
+"""
+import codecs
+import importlib
+import io
+import json
+import math
+import os
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+# 单条 stream 消息的最大缓冲长度
+STREAM_BUFFER_SIZE = 4096
+
+# 子进程退出后等待后台进程释放输出管道的时间（秒）
+BACKGROUND_OUTPUT_GRACE = 1
+
+# 常驻内核中执行超时的退出码，与 coreutils timeout 一致
+TIMEOUT_EXIT_CODE = 124
+
+# 是否正在执行用户代码，只有执行期间的 SIGINT 会中断执行
+_executing = False
+
+
+class _ExecutionTimeout(BaseException):
+    """执行超时，继承BaseException避免被用户代码中的 except Exception 吞掉"""
+
+
+def _handle_interrupt(signum, frame):
+    if _executing:
+        raise KeyboardInterrupt
+
+
+def _handle_timeout(signum, frame):
+    if _executing:
+        raise _ExecutionTimeout("CPU时间" if signum == signal.SIGPROF else "执行时间")
+
+
+def _set_timers(timeout, cpu_timeout):
+    signal.setitimer(signal.ITIMER_REAL, timeout or 0)
+    signal.setitimer(signal.ITIMER_PROF, cpu_timeout or 0)
+
+
+class _ProtocolChannel:
+    """内核到宿主机的协议通道，独占原始的 stdout 文件描述符"""
+
+    def __init__(self):
+        # 复制原始 stdout 作为协议通道，再把 fd 1 指向 stderr，
+        # 防止用户代码启动的子进程直接写 stdout 破坏协议
+        self._fd = os.dup(1)
+        os.dup2(2, 1)
+        self._out = os.fdopen(self._fd, "w", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        line = json.dumps(message, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._out.write(line)
+            self._out.flush()
+
+
+class _StreamWriter(io.TextIOBase):
+    """把用户代码的 print 输出转成 stream 消息"""
+
+    def __init__(self, channel, name):
+        self._channel = channel
+        self._name = name
+        self._buffer = []
+        self._size = 0
+        self.request_id = None
+
+    @property
+    def encoding(self):
+        return "utf-8"
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not text:
+            return 0
+        self._buffer.append(text)
+        self._size += len(text)
+        if "\n" in text or self._size >= STREAM_BUFFER_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self._channel.send({"type": "stream", "id": self.request_id, "name": self._name, "text": text})
+
+
+def _reset_peak_memory():
+    """清零本进程的内存峰值（VmHWM），成功返回True"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_memory():
+    """读取本进程自上次清零以来的内存峰值（KB），无法读取时返回None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+class _Usage:
+    """记录一次执行的墙钟时间、CPU时间和内存峰值
+
+    children_only 为 True 时只统计子进程（一次性执行模式），不计入辅助脚本自身的开销。
+    常驻内核中 ru_maxrss 是进程生命周期内的峰值，因此每次执行前清零 VmHWM，执行后读取本次的峰值；
+    子进程的 ru_maxrss 只有在本次执行中变大时才计入。
+    """
+
+    def __init__(self, children_only=False):
+        self._children_only = children_only
+        self._scopes = [resource.RUSAGE_CHILDREN] if children_only else [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN]
+        self._children_peak_start = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        self._peak_reset = False if children_only else _reset_peak_memory()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = self._cpu_time()
+
+    def _cpu_time(self):
+        usages = [resource.getrusage(scope) for scope in self._scopes]
+        return sum(usage.ru_utime + usage.ru_stime for usage in usages)
+
+    def _peak_memory_kb(self):
+        # ru_maxrss 在Linux上以KB为单位
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if self._children_only:
+            return children_peak
+        if children_peak <= self._children_peak_start:
+            children_peak = 0
+        self_peak = _peak_memory() if self._peak_reset else None
+        if self_peak is None:
+            self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max(self_peak, children_peak)
+
+    def stats(self):
+        return {
+            "wall_time": round(time.perf_counter() - self._wall_start, 6),
+            "cpu_time": round(self._cpu_time() - self._cpu_start, 6),
+            "peak_memory_kb": self._peak_memory_kb()
+        }
+
+
+def _run(namespace, code, work_dir, timeout=None, cpu_timeout=None):
+    """在持久化命名空间中执行代码，错误信息写入 sys.stderr，返回(退出码, 是否超时)"""
+    global _executing
+    try:
+        if work_dir:
+            os.makedirs(work_dir, exist_ok=True)
+            os.chdir(work_dir)
+    except OSError as e:
+        sys.stderr.write(f"无法进入工作目录 {work_dir}: {e}\n")
+        return 1, False
+    # 执行之间可能安装了新的包，清除导入系统缓存的目录列表
+    importlib.invalidate_caches()
+    try:
+        _executing = True
+        _set_timers(timeout, cpu_timeout)
+        try:
+            exec(compile(code, "<task>", "exec"), namespace)
+        finally:
+            _set_timers(0, 0)
+            _executing = False
+    except _ExecutionTimeout as e:
+        limit = cpu_timeout if str(e) == "CPU时间" else timeout
+        sys.stderr.write(f"TimeoutError: {e}超过 {limit} 秒，执行已被终止\n")
+        return TIMEOUT_EXIT_CODE, True
+    except KeyboardInterrupt:
+        sys.stderr.write("KeyboardInterrupt: 执行已被中断\n")
+        return 130, False
+    except SystemExit as e:
+        if e.code is None or e.code == 0:
+            return 0, False
+        if isinstance(e.code, int):
+            return e.code, False
+        sys.stderr.write(f"{e.code}\n")
+        return 1, False
+    except BaseException:
+        # 去掉内核自身的调用栈帧，只保留用户代码部分
+        etype, value, tb = sys.exc_info()
+        sys.stderr.write("".join(traceback.format_exception(etype, value, tb.tb_next)))
+        return 1, False
+    return 0, False
+
+
+def serve():
+    """读取宿主机请求并逐个执行"""
+    channel = _ProtocolChannel()
+    stdout = _StreamWriter(channel, "stdout")
+    stderr = _StreamWriter(channel, "stderr")
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    signal.signal(signal.SIGINT, _handle_interrupt)
+    signal.signal(signal.SIGALRM, _handle_timeout)
+    signal.signal(signal.SIGPROF, _handle_timeout)
+
+    # 协议请求独占 stdin，用户代码读取的是空输入
+    request_lines = sys.stdin
+    sys.stdin = io.StringIO()
+
+    channel.send({"type": "ready", "pid": os.getpid()})
+
+    for line in request_lines:
+        line = line.strip()
+        if not line:
+            continue
+        request = json.loads(line)
+        stdout.request_id = stderr.request_id = request.get("id")
+
+        usage = _Usage()
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            exit_code, timed_out = _run(
+                namespace,
+                request.get("code", ""),
+                request.get("work_dir"),
+                request.get("timeout"),
+                request.get("cpu_timeout")
+            )
+        finally:
+            stdout.flush()
+            stderr.flush()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+
+        channel.send({
+            "type": "result",
+            "id": request.get("id"),
+            "exit_code": exit_code,
+            "error": "",
+            "timed_out": timed_out,
+            **usage.stats()
+        })
+
+
+def _forward(channel, pipe, name, request_id):
+    """把子进程管道中的输出按块转成 stream 消息"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in iter(lambda: pipe.read1(STREAM_BUFFER_SIZE), b""):
+        text = decoder.decode(chunk)
+        if text:
+            channel.send({"type": "stream", "id": request_id, "name": name, "text": text})
+    text = decoder.decode(b"", final=True)
+    if text:
+        channel.send({"type": "stream", "id": request_id, "name": name, "text": text})
+
+
+def _kill_group(process, sig=signal.SIGKILL):
+    """结束子进程所在的进程组，包括它启动的所有子进程"""
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run_once(language, tag):
+    """在子进程中执行从stdin收到的代码，分别转发stdout与stderr并报告资源使用情况"""
+    channel = _ProtocolChannel()
+    request = json.loads(sys.stdin.readline())
+    timeout = request.get("timeout")
+    cpu_timeout = request.get("cpu_timeout")
+
+    # 代码只写入容器内的临时目录，不经过宿主机挂载目录
+    suffix = ".py" if language == "python" else ".sh"
+    path = os.path.join(tempfile.gettempdir(), f"agent_manus_{tag}{suffix}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(request.get("code", ""))
+    command = ["python", path] if language == "python" else ["bash", path]
+
+    def limit_cpu():
+        # 超过软限制收到SIGXCPU，再超过1秒收到SIGKILL
+        limit = math.ceil(cpu_timeout)
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+
+    timed_out = False
+    try:
+        usage = _Usage(children_only=True)
+        # 子进程在独立的进程组中运行，超时或取消时结束整个进程组
+        try:
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=request.get("work_dir") or None,
+                env={**os.environ, "PYTHONUNBUFFERED": "1"},
+                start_new_session=True,
+                preexec_fn=limit_cpu if cpu_timeout else None
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            # 例如工作目录不存在，仍然报告结果，宿主机无需等到连接关闭
+            channel.send({
+                "type": "result",
+                "id": request.get("id"),
+                "exit_code": -1,
+                "error": f"启动执行进程失败: {e}",
+                "timed_out": False
+            })
+            return
+        # 宿主机取消执行时结束子进程组，仍然正常报告结果
+        signal.signal(signal.SIGTERM, lambda signum, frame: _kill_group(process, signal.SIGTERM))
+
+        forwarders = [
+            threading.Thread(target=_forward, args=(channel, process.stdout, "stdout", request.get("id"))),
+            threading.Thread(target=_forward, args=(channel, process.stderr, "stderr", request.get("id")))
+        ]
+        for forwarder in forwarders:
+            forwarder.start()
+        try:
+            exit_code = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            _kill_group(process)
+            exit_code = process.wait()
+            timed_out = True
+            message = f"TimeoutError: 执行时间超过 {timeout} 秒，执行已被终止\n"
+            channel.send({"type": "stream", "id": request.get("id"), "name": "stderr", "text": message})
+        if cpu_timeout and exit_code == -signal.SIGXCPU:
+            timed_out = True
+            message = f"TimeoutError: CPU时间超过 {cpu_timeout} 秒，执行已被终止\n"
+            channel.send({"type": "stream", "id": request.get("id"), "name": "stderr", "text": message})
+        # 进程组中残留的后台进程仍占用输出管道时一并结束，避免执行无法返回
+        forwarders[0].join(BACKGROUND_OUTPUT_GRACE)
+        if any(forwarder.is_alive() for forwarder in forwarders):
+            _kill_group(process)
+        for forwarder in forwarders:
+            forwarder.join()
+    finally:
+        os.unlink(path)
+
+    channel.send({
+        "type": "result",
+        "id": request.get("id"),
+        "exit_code": exit_code,
+        "error": "",
+        "timed_out": timed_out,
+        **usage.stats()
+    })
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        run_once(sys.argv[2], sys.argv[3])
+    else:
+        serve()
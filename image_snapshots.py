@@ -0,0 +1,145 @@
+import io
+import os
+import re
+import time
+import tarfile
+import hashlib
+from typing import List, Optional
+
+import docker
+
+# 用户环境快照镜像：保存用户安装过的包，下次会话直接从快照启动
+SNAPSHOT_REPOSITORY = os.getenv("DOCKER_SNAPSHOT_REPOSITORY", "agent-manus-snapshot")
+# 每个用户保留的快照数量，以及快照的最长保留时间（秒）
+DOCKER_SNAPSHOT_KEEP = int(os.getenv("DOCKER_SNAPSHOT_KEEP", "1"))
+DOCKER_SNAPSHOT_TTL = float(os.getenv("DOCKER_SNAPSHOT_TTL", str(7 * 24 * 3600)))
+
+LABEL_USER = "agent_manus.snapshot.user"
+LABEL_PACKAGES = "agent_manus.snapshot.packages"
+LABEL_CREATED = "agent_manus.snapshot.created"
+
+# 快照镜像构建时写入的依赖文件
+SNAPSHOT_REQUIREMENTS = "/tmp/agent_manus_snapshot_requirements.txt"
+SNAPSHOT_DOCKERFILE = f"""FROM {{base_image}}
+COPY requirements.txt {SNAPSHOT_REQUIREMENTS}
+RUN python -m pip install --no-cache-dir --disable-pip-version-check -r {SNAPSHOT_REQUIREMENTS} \\
+    && rm {SNAPSHOT_REQUIREMENTS}
+"""
+
+
+def frozen_requirements(freeze_output: str) -> List[str]:
+    """从 pip freeze 的输出中取出可以从索引重新安装的依赖（排序后）
+
+    可编辑安装和指向本地文件的依赖无法在构建镜像时重新安装，跳过。
+    """
+    requirements = []
+    for line in freeze_output.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", "-")) or " @ file:" in line:
+            continue
+        requirements.append(line)
+    return sorted(requirements)
+
+
+def packages_hash(freeze_output: str) -> str:
+    """根据 pip freeze 的输出计算已安装包集合的哈希"""
+    return hashlib.sha256("\n".join(frozen_requirements(freeze_output)).encode("utf-8")).hexdigest()
+
+
+def snapshot_tag(user_id: str, package_hash: str) -> str:
+    """生成快照镜像的tag，用户ID中不允许的字符替换为下划线"""
+    safe_user = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)[:100]
+    return f"{safe_user}-{package_hash[:12]}"
+
+
+def list_snapshots(client: docker.DockerClient, user_id: Optional[str] = None) -> List:
+    """列出快照镜像，按创建时间从新到旧排序"""
+    label = f"{LABEL_USER}={user_id}" if user_id is not None else LABEL_USER
+    images = client.images.list(filters={"label": label})
+    return sorted(images, key=lambda image: float(image.labels.get(LABEL_CREATED, 0)), reverse=True)
+
+
+def find_snapshot(client: docker.DockerClient, user_id: str):
+    """查找用户最新的快照镜像，没有时返回None"""
+    snapshots = list_snapshots(client, user_id)
+    return snapshots[0] if snapshots else None
+
+
+def _build_context(base_image: str, requirements: List[str]) -> io.BytesIO:
+    files = {
+        "Dockerfile": SNAPSHOT_DOCKERFILE.format(base_image=base_image),
+        "requirements.txt": "\n".join(requirements) + "\n"
+    }
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode="w") as tar:
+        for name, content in files.items():
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    context.seek(0)
+    return context
+
+
+def build_snapshot(client: docker.DockerClient, base_image: str, user_id: str, freeze_output: str):
+    """从基础镜像构建用户的快照镜像，安装容器中 pip freeze 列出的包
+
+    快照总是以基础镜像为父镜像，不会在旧快照上叠加新的层，旧快照可以直接删除，镜像层数也不会增长；
+    快照沿用基础镜像的环境变量，不包含启动容器时传入的密钥。
+
+    Args:
+        client: docker-py客户端
+        base_image: 执行容器的基础镜像
+        user_id: 用户ID
+        freeze_output: 容器中 pip freeze 的输出
+
+    Returns:
+        docker-py镜像对象
+    """
+    package_hash = packages_hash(freeze_output)
+    image, _ = client.images.build(
+        fileobj=_build_context(base_image, frozen_requirements(freeze_output)),
+        custom_context=True,
+        tag=f"{SNAPSHOT_REPOSITORY}:{snapshot_tag(user_id, package_hash)}",
+        labels={
+            LABEL_USER: user_id,
+            LABEL_PACKAGES: package_hash,
+            LABEL_CREATED: str(time.time())
+        },
+        rm=True,
+        forcerm=True
+    )
+    return image
+
+
+def prune_snapshots(
+    client: docker.DockerClient,
+    user_id: Optional[str] = None,
+    keep: int = DOCKER_SNAPSHOT_KEEP,
+    max_age: float = DOCKER_SNAPSHOT_TTL
+) -> int:
+    """删除过期的快照镜像
+
+    每个用户只保留最新的keep个快照，超过max_age的快照全部删除；
+    正在被容器使用的镜像删除失败时跳过。
+
+    Returns:
+        int: 删除的镜像数量
+    """
+    now = time.time()
+    kept = {}
+    removed = 0
+    for image in list_snapshots(client, user_id):
+        owner = image.labels.get(LABEL_USER)
+        age = now - float(image.labels.get(LABEL_CREATED, 0))
+        if kept.get(owner, 0) < keep and age <= max_age:
+            kept[owner] = kept.get(owner, 0) + 1
+            continue
+        # 按tag删除：同一镜像还有其他tag时只移除快照的tag
+        name = next((tag for tag in image.tags if tag.startswith(f"{SNAPSHOT_REPOSITORY}:")), image.id)
+        try:
+            client.images.remove(name)
+            removed += 1
+        except docker.errors.APIError as e:
+            print(f"删除快照镜像失败 {name}: {str(e)}")
+    return removed
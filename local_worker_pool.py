@@ -0,0 +1,158 @@
+"""本地Python执行的预加载工作进程池
+
+基于 multiprocessing 的 forkserver：forkserver 进程启动时预先导入 numpy、pandas、matplotlib 等常用库，
+之后每次执行从 forkserver fork 一个新进程，在任务目录中运行代码，执行结束后进程退出。
+每次执行都在独立的进程中进行，互不共享状态，但无需重新启动解释器和导入科学计算库。
+
+只适合可信的开发环境，代码直接在宿主机上执行，没有任何隔离。
+"""
+import os
+import sys
+import signal
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from typing import Callable, List, Optional, Tuple
+
+# forkserver预先导入的模块，逗号分隔；导入失败的模块会被忽略
+LOCAL_WORKER_PRELOAD = [
+    module.strip()
+    for module in os.getenv("LOCAL_WORKER_PRELOAD", "numpy,pandas,matplotlib,matplotlib.pyplot").split(",")
+    if module.strip()
+]
+# 同时执行的最大任务数
+LOCAL_WORKER_MAX_JOBS = int(os.getenv("LOCAL_WORKER_MAX_JOBS", str(os.cpu_count() or 4)))
+
+_local_worker_pool: Optional["LocalWorkerPool"] = None
+_local_worker_pool_lock = threading.Lock()
+
+
+def _main_module_name() -> Optional[str]:
+    """返回主程序的模块名
+
+    子进程启动时会重新执行主模块（Python 3.11及以前的forkserver不会预先导入主模块）；
+    在forkserver中按模块名预加载主模块后，主模块依赖的库都已导入，子进程重新执行时只需运行模块本身。
+    """
+    main_module = sys.modules.get("__main__")
+    spec = getattr(main_module, "__spec__", None)
+    if spec is not None:
+        return spec.name
+    main_path = getattr(main_module, "__file__", None)
+    if not main_path:
+        return None
+    return os.path.splitext(os.path.basename(main_path))[0]
+
+
+def _run_job(code: str, work_dir: str, stdout_path: str, stderr_path: str) -> None:
+    """在fork出的子进程中执行代码，输出重定向到文件"""
+    # 独立的进程组，超时或取消时结束代码启动的所有子进程
+    os.setsid()
+    os.chdir(work_dir)
+    sys.path.insert(0, work_dir)
+
+    for fd, path in ((1, stdout_path), (2, stderr_path)):
+        file_fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(file_fd, fd)
+        os.close(file_fd)
+    sys.stdout = open(1, "w", encoding="utf-8", buffering=1, closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", buffering=1, closefd=False)
+
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    try:
+        exec(compile(code, "<code>", "exec"), namespace)
+    except SystemExit:
+        raise
+    except BaseException:
+        # 去掉本函数的调用栈帧，只保留用户代码部分
+        etype, value, tb = sys.exc_info()
+        sys.stderr.write("".join(traceback.format_exception(etype, value, tb.tb_next)))
+        sys.exit(1)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+class LocalWorkerPool:
+    """从预加载了常用库的forkserver派生进程执行Python代码"""
+    def __init__(self, preload: List[str] = LOCAL_WORKER_PRELOAD, max_jobs: int = LOCAL_WORKER_MAX_JOBS):
+        self.preload = preload
+        self.max_jobs = max_jobs
+        self._context = multiprocessing.get_context("forkserver")
+        self._slots = threading.BoundedSemaphore(max_jobs)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self) -> "LocalWorkerPool":
+        """启动forkserver并完成预加载，之后的执行无需等待导入"""
+        with self._start_lock:
+            if not self._started:
+                # forkserver继承当前环境变量，画图库使用非交互后端
+                os.environ.setdefault("MPLBACKEND", "Agg")
+                preload = ["__main__", __name__] + self.preload
+                main_module = _main_module_name()
+                if main_module:
+                    preload.append(main_module)
+                self._context.set_forkserver_preload(preload)
+                # 执行一个空任务，触发forkserver启动
+                process = self._context.Process(target=os.getpid)
+                process.start()
+                process.join()
+                self._started = True
+        return self
+
+    def run(
+        self,
+        code: str,
+        work_dir: str,
+        timeout: Optional[float] = None,
+        on_start: Optional[Callable[[int], None]] = None
+    ) -> Tuple[int, str, str, bool]:
+        """在新进程中执行Python代码
+
+        Args:
+            code: Python代码
+            work_dir: 执行代码的工作目录
+            timeout: 墙钟时间限制（秒），超时后结束进程组
+            on_start: 进程启动后以进程ID调用，用于注册取消
+
+        Returns:
+            (退出码, 标准输出, 标准错误输出, 是否超时)
+        """
+        self.start()
+        with self._slots, tempfile.TemporaryDirectory(prefix="local-worker-") as output_dir:
+            stdout_path = os.path.join(output_dir, "stdout")
+            stderr_path = os.path.join(output_dir, "stderr")
+            process = self._context.Process(target=_run_job, args=(code, work_dir, stdout_path, stderr_path))
+            process.start()
+            if on_start is not None:
+                on_start(process.pid)
+
+            process.join(timeout)
+            timed_out = process.is_alive()
+            if timed_out:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                process.join()
+
+            outputs = []
+            for path in (stdout_path, stderr_path):
+                try:
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        outputs.append(f.read())
+                except FileNotFoundError:
+                    outputs.append("")
+            return process.exitcode, outputs[0], outputs[1], timed_out
+
+
+def get_local_worker_pool() -> LocalWorkerPool:
+    """获取共享的本地工作进程池"""
+    global _local_worker_pool
+
+    with _local_worker_pool_lock:
+        if _local_worker_pool is None:
+            _local_worker_pool = LocalWorkerPool()
+
+    return _local_worker_pool
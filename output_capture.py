@@ -0,0 +1,111 @@
+import os
+from typing import Any, Dict, List, Optional
+
+# 执行输出限制：超过MAX字符时只保留开头和结尾，完整输出写入任务目录下的日志文件
+EXECUTION_OUTPUT_MAX_CHARS = int(os.getenv("EXECUTION_OUTPUT_MAX_CHARS", "8000"))
+EXECUTION_OUTPUT_HEAD_CHARS = int(os.getenv("EXECUTION_OUTPUT_HEAD_CHARS", "3000"))
+EXECUTION_OUTPUT_TAIL_CHARS = int(os.getenv("EXECUTION_OUTPUT_TAIL_CHARS", "3000"))
+
+# 完整输出日志相对任务目录的子目录
+EXECUTION_LOG_DIR = ".execution_logs"
+
+
+class OutputCapture:
+    """有界的执行输出收集器
+
+    输出不超过max_chars时完整保存在内存中；超过后把完整输出写入spill_path，
+    内存中只保留开头head_chars和结尾tail_chars个字符，避免大输出撑爆内存和LLM上下文。
+    """
+    def __init__(
+        self,
+        spill_path: str,
+        max_chars: int = EXECUTION_OUTPUT_MAX_CHARS,
+        head_chars: int = EXECUTION_OUTPUT_HEAD_CHARS,
+        tail_chars: int = EXECUTION_OUTPUT_TAIL_CHARS
+    ):
+        self.spill_path = spill_path
+        self.max_chars = max_chars
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.total_chars = 0
+        self.total_bytes = 0
+        self.total_lines = 0
+        self._chunks: List[str] = []
+        self._head = ""
+        self._tail = ""
+        self._spill_file = None
+        self._ends_with_newline = True
+
+    @property
+    def truncated(self) -> bool:
+        return self._spill_file is not None
+
+    def write(self, text: str) -> None:
+        """追加一段输出"""
+        if not text:
+            return
+        self.total_chars += len(text)
+        self.total_bytes += len(text.encode("utf-8"))
+        self.total_lines += text.count("\n")
+        self._ends_with_newline = text.endswith("\n")
+
+        if self._spill_file is None:
+            self._chunks.append(text)
+            if self.total_chars <= self.max_chars:
+                return
+            self._start_spill()
+            return
+
+        self._spill_file.write(text)
+        self._tail = self._keep_tail(self._tail + text)
+
+    def _start_spill(self) -> None:
+        text = "".join(self._chunks)
+        self._chunks = []
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        self._spill_file = open(self.spill_path, "w", encoding="utf-8")
+        self._spill_file.write(text)
+        self._head = text[:self.head_chars]
+        self._tail = self._keep_tail(text)
+
+    def _keep_tail(self, text: str) -> str:
+        # text[-0:]会保留整个字符串，tail_chars为0时不保留结尾
+        return text[-self.tail_chars:] if self.tail_chars > 0 else ""
+
+    def close(self) -> None:
+        """关闭日志文件"""
+        if self._spill_file is not None and not self._spill_file.closed:
+            self._spill_file.close()
+
+    def text(self) -> str:
+        """返回输出内容，被截断时为开头和结尾的摘要"""
+        if not self.truncated:
+            return "".join(self._chunks)
+        omitted = self.total_chars - len(self._head) - len(self._tail)
+        return (
+            f"{self._head}\n"
+            f"...[输出过长，已省略中间 {omitted} 个字符，完整输出见 {self.spill_path}]...\n"
+            f"{self._tail}"
+        )
+
+    def stats(self, prefix: str = "output") -> Dict[str, Any]:
+        """返回输出的字节数、行数以及完整日志路径
+
+        Args:
+            prefix: 统计字段名前缀，例如 "output" 得到 output_bytes、output_lines 等
+        """
+        lines = self.total_lines + (0 if self._ends_with_newline else 1)
+        stats: Dict[str, Any] = {
+            f"{prefix}_bytes": self.total_bytes,
+            f"{prefix}_lines": lines,
+            f"{prefix}_truncated": self.truncated
+        }
+        if self.truncated:
+            stats[f"{prefix}_log_path"] = self.spill_path
+        return stats
+
+
+def execution_log_path(task_dir: str, execution_id: str, stream: Optional[str] = None) -> str:
+    """生成执行输出日志在任务目录中的路径"""
+    name = f"{execution_id}-{stream}.log" if stream else f"{execution_id}.log"
+    return os.path.join(task_dir, EXECUTION_LOG_DIR, name)
@@ -25,9 +25,14 @@ REACT_AGENT_CONTEXT = """
 注意：
 - 尽量让每一步的任务简单，你可以分成多步来更好的完成任务
 - 确保输入工具正确的代码语言,Python使用language='python',Shell使用language='bash'
-- 如果工具返回缺失python包, 请使用pip install命令脚本安装
+- 执行Python代码前会自动安装代码中导入的缺失常用第三方包（见结果中的installed_packages，未安装的原因见install_error）；如果工具仍返回缺失python包, 请确认包名正确后使用pip install命令脚本安装
 - 注意代码生成和执行是分开的两个步骤
 - 请确保在一次任务过程中使用唯一的task_id来保持上下文
+- 同一task_id下的Python代码在常驻内核中执行，之前步骤定义的变量、导入的模块和已加载的数据可以直接使用
+- 执行结果以success判断是否成功；output为标准输出，error为标准错误输出，成功时error中可能只是警告信息
+- 执行结果中timed_out为true表示执行超时被终止，请拆分为更小的步骤或在确有必要时指定更长的timeout
+- 执行结果中syntax_error为true表示代码存在语法错误，未在容器中执行，请根据error修正后重新执行
+- 执行输出过长时只返回开头和结尾，完整输出保存在output_log_path或error_log_path指向的文件中，需要时用代码读取其中的关键部分，避免打印大量数据
 - 请给予generate_python_code必要的额外上下文信息,以便生成更准确的代码，但不要假设信息
 - 注意评估每一步是否已经完成目标任务，并决定下一步的行动
 - 参考用户的历史记忆来提供更个性化的服务
@@ -0,0 +1,59 @@
+from code_dependencies import _STATIC_STDLIB_MODULES, find_imports, is_auto_install_allowed, package_name, third_party_imports
+
+
+def test_find_imports_top_level_names():
+    code = "import os.path\nimport numpy as np\nfrom pandas.io import json\nfrom . import local\n"
+    assert find_imports(code) == {"os", "numpy", "pandas"}
+
+
+def test_find_imports_skips_optional_imports():
+    code = (
+        "try:\n"
+        "    import ujson as json\n"
+        "except ImportError:\n"
+        "    import json\n"
+    )
+    assert find_imports(code) == {"json"}
+
+
+def test_find_imports_keeps_imports_in_other_try_blocks():
+    code = (
+        "try:\n"
+        "    import requests\n"
+        "except ValueError:\n"
+        "    pass\n"
+    )
+    assert find_imports(code) == {"requests"}
+
+
+def test_find_imports_nested_in_functions():
+    code = "def f():\n    import scipy.stats\n    return scipy\n"
+    assert find_imports(code) == {"scipy"}
+
+
+def test_find_imports_invalid_code():
+    assert find_imports("import (") == set()
+
+
+def test_third_party_imports_excludes_stdlib():
+    code = "import os\nimport json\nimport sklearn\nimport bs4\nfrom __future__ import annotations\n"
+    assert third_party_imports(code) == ["bs4", "sklearn"]
+
+
+def test_static_stdlib_list_covers_common_modules():
+    # Python 3.9没有sys.stdlib_module_names，只能依赖静态列表
+    for module in ("os", "sys", "json", "re", "collections", "asyncio", "typing", "zoneinfo", "tomllib"):
+        assert module in _STATIC_STDLIB_MODULES
+
+
+def test_package_name_mapping():
+    assert package_name("sklearn") == "scikit-learn"
+    assert package_name("PIL") == "Pillow"
+    assert package_name("numpy") == "numpy"
+
+
+def test_auto_install_allowlist():
+    assert is_auto_install_allowed("pandas")
+    assert is_auto_install_allowed("scikit-learn")
+    assert is_auto_install_allowed("Scikit_Learn")
+    assert not is_auto_install_allowed("pandas-helperz")
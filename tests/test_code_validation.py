@@ -0,0 +1,69 @@
+import shutil
+
+import pytest
+
+from code_validation import check_python_syntax, check_shell_syntax, strip_code_fences, validate_code
+
+
+def test_strip_fenced_block():
+    assert strip_code_fences("```python\nprint(1)\n```") == "print(1)"
+
+
+def test_strip_fenced_block_with_surrounding_whitespace():
+    assert strip_code_fences("\n  ```python\nx = 1\nprint(x)\n```\n") == "x = 1\nprint(x)"
+
+
+def test_strip_multiple_blocks_drops_explanation():
+    code = "```python\nx = 1\n```\n说明文字\n```python\nprint(x)\n```"
+    assert strip_code_fences(code) == "x = 1\nprint(x)"
+
+
+def test_keep_fences_inside_valid_program():
+    code = 'md = """\n```python\nx=1\n```\n"""\nprint(md)'
+    assert strip_code_fences(code) == code
+
+
+def test_strip_when_only_stripped_code_compiles():
+    code = "下面是代码:\n```python\nprint(1)\n```"
+    assert strip_code_fences(code) == "print(1)"
+
+
+def test_keep_invalid_code_when_stripping_does_not_help():
+    code = "print(\n```"
+    assert strip_code_fences(code) == code
+
+
+def test_code_without_fences_unchanged():
+    code = "print('hello')\n"
+    assert strip_code_fences(code) == code
+
+
+def test_check_python_syntax():
+    assert check_python_syntax("x = 1") is None
+    error = check_python_syntax("def f(:\n    pass", target_version=(3, 0))
+    assert error is not None and "SyntaxError" in error
+
+
+def test_check_python_syntax_skipped_for_newer_target():
+    # 宿主机版本低于目标版本时，编译失败不判定为语法错误
+    assert check_python_syntax("def f(:\n    pass", target_version=(99, 0)) is None
+
+
+def test_check_python_syntax_null_byte():
+    assert check_python_syntax("x = 1\0") is not None
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="需要bash")
+def test_check_shell_syntax():
+    assert check_shell_syntax("echo hi") is None
+    assert check_shell_syntax("if true; then echo hi") is not None
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="需要bash")
+def test_strip_shell_fences():
+    assert strip_code_fences("```bash\necho hi\n```", "bash") == "echo hi"
+
+
+def test_validate_code_dispatches_by_language():
+    assert validate_code("x = 1", "python") is None
+    assert validate_code("x = (", "python") is not None
@@ -0,0 +1,35 @@
+import os
+
+from output_capture import OutputCapture
+
+
+def test_small_output_kept_in_memory(tmp_path):
+    capture = OutputCapture(str(tmp_path / "out.log"), max_chars=100, head_chars=10, tail_chars=10)
+    capture.write("hello\n")
+    assert capture.text() == "hello\n"
+    assert not capture.truncated
+    assert not os.path.exists(tmp_path / "out.log")
+
+
+def test_large_output_keeps_head_and_tail(tmp_path):
+    capture = OutputCapture(str(tmp_path / "out.log"), max_chars=10, head_chars=3, tail_chars=4)
+    for _ in range(10):
+        capture.write("abcdefghij")
+    capture.close()
+    assert capture.truncated
+    text = capture.text()
+    assert text.startswith("abc\n")
+    assert text.endswith("\nghij")
+    assert "93" in text
+    with open(tmp_path / "out.log", encoding="utf-8") as f:
+        assert f.read() == "abcdefghij" * 10
+
+
+def test_zero_tail_keeps_nothing(tmp_path):
+    capture = OutputCapture(str(tmp_path / "out.log"), max_chars=10, head_chars=3, tail_chars=0)
+    for _ in range(100):
+        capture.write("abcdefghij")
+    capture.close()
+    text = capture.text()
+    assert text.endswith("]...\n")
+    assert "997" in text
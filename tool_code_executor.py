@@ -1,62 +1,338 @@
 import re
 import os
+import signal
 import tempfile
+import subprocess
 import asyncio
 import docker
 import uuid
 import time
 import json
-from typing import List, Optional, Dict, Any
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Dict, Any, Tuple
 from dataclasses import dataclass
 from llama_index.core.tools import BaseTool,ToolOutput,AsyncBaseTool
 from llama_index.core.tools.types import ToolMetadata
 from llama_index.core.tools import FunctionTool
-from docker_container import DockerContainer
+from docker_container import DockerContainer, build_execution_result, close_docker_client, get_docker_client, parse_memory, EXECUTION_METRICS
+from docker_container import wait_for_snapshot_builds
+from container_scheduler import get_admission_controller
+from image_snapshots import prune_snapshots
+from container_pool import WarmContainerPool
+from async_executor import run_blocking
+from output_capture import OutputCapture, execution_log_path
+from code_validation import strip_code_fences, validate_code
+from code_dependencies import third_party_imports
+from local_worker_pool import get_local_worker_pool
 
 # 全局变量 - Docker容器映射表（按用户ID组织）
 _docker_containers: Dict[str, DockerContainer] = {}
 
+# 保护容器映射表的锁，以及按用户串行化容器创建/回收的锁
+_containers_lock = threading.RLock()
+_user_container_locks: Dict[str, threading.Lock] = {}
+
+# 执行输出监听器
+_output_listeners: List[Callable[[str, str, str, str], None]] = []
+_output_listeners_lock = threading.Lock()
+
+# 正在进行的Docker执行（按用户ID和任务ID组织），用于取消
+_active_executions: Dict[Tuple[str, str], Dict[str, Any]] = {}
+_active_executions_lock = threading.Lock()
+
+# 预热容器池，大小为0时不启用
+_warm_pool: Optional[WarmContainerPool] = None
+
+# 空闲容器回收线程
+_reaper_thread: Optional[threading.Thread] = None
+_reaper_stopped = threading.Event()
+
 # 任务目录映射（按用户ID和任务ID组织）
 _task_directories: Dict[str, Dict[str, str]] = {}
+_task_directories_lock = threading.Lock()
 
 # 基本工作目录
 BASE_WORK_DIR = "/Users/pingcy/workspace/tasks"
+# 用户ID会作为工作目录名和容器名的一部分，只允许安全字符
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# 后台提前为用户启动容器时的最大并行数，0表示不预热
+DOCKER_WARM_POOL_SIZE = int(os.getenv("DOCKER_WARM_POOL_SIZE", "0"))
+
+# 容器空闲超时（秒）、最大存活容器数量（0表示不限制）和回收检查间隔（秒）
+DOCKER_CONTAINER_IDLE_TTL = float(os.getenv("DOCKER_CONTAINER_IDLE_TTL", "1800"))
+DOCKER_MAX_CONTAINERS = int(os.getenv("DOCKER_MAX_CONTAINERS", "0"))
+DOCKER_REAPER_INTERVAL = float(os.getenv("DOCKER_REAPER_INTERVAL", "30"))
+
+# 是否为每个用户保存安装过包的快照镜像，以及清理过期快照的间隔（秒）
+DOCKER_USER_SNAPSHOTS = os.getenv("DOCKER_USER_SNAPSHOTS", "false").lower() == "true"
+DOCKER_SNAPSHOT_GC_INTERVAL = float(os.getenv("DOCKER_SNAPSHOT_GC_INTERVAL", "3600"))
+
+# 每次执行的默认墙钟时间和CPU时间限制（秒），0表示不限制
+EXECUTION_TIMEOUT = float(os.getenv("EXECUTION_TIMEOUT", "600"))
+EXECUTION_CPU_TIMEOUT = float(os.getenv("EXECUTION_CPU_TIMEOUT", "0"))
+
+# 本地执行Python代码时是否使用预加载了常用库的工作进程池（仅适用于可信环境）
+LOCAL_WORKER_POOL = os.getenv("LOCAL_WORKER_POOL", "false").lower() == "true"
+
+# 执行Python代码前是否自动安装代码导入的缺失第三方包
+DOCKER_AUTO_INSTALL_PACKAGES = os.getenv("DOCKER_AUTO_INSTALL_PACKAGES", "true").lower() == "true"
+# 结果中保留的pip安装错误信息的最大字符数
+INSTALL_ERROR_MAX_CHARS = 2000
+
+def get_warm_pool(
+    size: Optional[int] = None,
+    image: str = "python_code_executor:3.11"
+) -> Optional[WarmContainerPool]:
+    """获取容器预热器，建议在服务启动时调用
+    
+    Args:
+        size: 后台同时启动容器的最大数量，如不提供则使用DOCKER_WARM_POOL_SIZE
+        image: Docker镜像名称
+        
+    Returns:
+        WarmContainerPool: 容器预热器，数量为0时返回None
+    """
+    global _warm_pool
+    
+    with _containers_lock:
+        if _warm_pool is None:
+            size = DOCKER_WARM_POOL_SIZE if size is None else size
+            if size <= 0:
+                return None
+            _warm_pool = WarmContainerPool(
+                lambda user_id: get_docker_container(user_id, image=image),
+                max_parallel_starts=size
+            )
+    
+    return _warm_pool
+
+def prewarm_docker_container(user_id: str = "default") -> bool:
+    """在后台提前启动用户的容器，第一次执行代码时无需等待容器启动
+    
+    适合在收到用户任务、LLM生成第一步期间调用；预热未启用或用户容器已存在时不做任何事。
+    
+    Returns:
+        bool: 是否开始了后台启动
+    """
+    with _containers_lock:
+        if user_id in _docker_containers:
+            return False
+    warm_pool = get_warm_pool()
+    return warm_pool.prewarm(user_id) if warm_pool else False
+
+def _get_user_container_lock(user_id: str) -> threading.Lock:
+    with _containers_lock:
+        return _user_container_locks.setdefault(user_id, threading.Lock())
+
+def validate_user_id(user_id: str) -> str:
+    """检查用户ID只包含字母、数字和 _ . -，且不含".."，避免拼接路径时逃出BASE_WORK_DIR
+    
+    Raises:
+        ValueError: 用户ID不合法
+    """
+    if not isinstance(user_id, str) or not USER_ID_PATTERN.match(user_id) or ".." in user_id:
+        raise ValueError(f"不合法的用户ID: {user_id!r}")
+    return user_id
 
 def get_docker_container(
     user_id: str = "default",
     image: str = "python_code_executor:3.11",
     container_name: Optional[str] = None,
+    mem_limit: Optional[str] = None,
+    cpus: Optional[float] = None,
+    pids_limit: Optional[int] = None
 ) -> DockerContainer:
     """获取或创建特定用户的Docker容器
     
+    创建新容器前按其资源配额向准入控制器预留宿主机资源，资源不足时先淘汰最久未使用的
+    空闲容器，仍不足则排队等待，超时抛出ContainerCapacityError。
+    资源配额只在创建容器时生效，已存在的容器沿用创建时的配额。
+    
     Args:
         user_id: 用户ID，用于区分不同用户
         image: Docker镜像名称
         container_name: 容器名称，如不提供则根据用户ID生成
+        mem_limit: 内存配额，例如"2g"，如不提供则使用DOCKER_MEM_LIMIT
+        cpus: CPU核数配额，如不提供则使用DOCKER_CPUS
+        pids_limit: 最大进程数，如不提供则使用DOCKER_PIDS_LIMIT
         
     Returns:
         DockerContainer: 用户专属的容器实例
     """
     global _docker_containers
     
+    validate_user_id(user_id)
+    
     # 如果不提供容器名称则根据用户ID生成
     if container_name is None:
         container_name = f"llamaindex-executor-{user_id}"
     
-    # 为用户创建专属容器
-    if user_id not in _docker_containers or _docker_containers[user_id] is None:
-        _docker_containers[user_id] = DockerContainer(
-            image=image,
-            container_name=container_name,
-            base_work_dir=os.path.join(BASE_WORK_DIR, user_id)
+    start_container_reaper()
+    
+    with _get_user_container_lock(user_id):
+        container = _docker_containers.get(user_id)
+        
+        # 为用户创建专属容器，已被回收的容器在此透明重建
+        if container is None:
+            # 达到容器数量上限时先淘汰最久未使用的容器
+            if DOCKER_MAX_CONTAINERS > 0:
+                reap_docker_containers(idle_ttl=0, max_containers=DOCKER_MAX_CONTAINERS - 1)
+            
+            # 确保用户基本工作目录存在
+            user_work_dir = os.path.join(BASE_WORK_DIR, user_id)
+            os.makedirs(user_work_dir, exist_ok=True)
+            
+            # 用户有快照镜像时start()直接从快照创建
+            snapshot_user = user_id if DOCKER_USER_SNAPSHOTS else None
+            resources = {
+                key: value for key, value in
+                (("mem_limit", mem_limit), ("cpus", cpus), ("pids_limit", pids_limit))
+                if value is not None
+            }
+            container = DockerContainer(
+                image=image,
+                container_name=container_name,
+                base_work_dir=user_work_dir,
+                snapshot_user=snapshot_user,
+                **resources
+            )
+            _admit_container(container)
+            try:
+                container.start()
+            except Exception:
+                get_admission_controller().release(container)
+                raise
+            
+            with _containers_lock:
+                _docker_containers[user_id] = container
+        
+        container.last_used = time.time()
+    
+    return container
+
+def _admit_container(container: DockerContainer) -> None:
+    """为新容器预留宿主机资源"""
+    controller = get_admission_controller()
+    cpus = container.cpus or 0
+    memory = parse_memory(container.mem_limit)
+    # 资源不足时逐个淘汰最久未使用的空闲容器，没有可淘汰的容器时排队等待
+    while not controller.try_admit(container, cpus, memory):
+        with _containers_lock:
+            live_count = len(_docker_containers)
+        if live_count <= 1 or not reap_docker_containers(idle_ttl=0, max_containers=live_count - 1):
+            controller.admit(container, cpus, memory)
+            return
+
+@contextmanager
+def acquire_docker_container(user_id: str = "default"):
+    """获取用户容器并在使用期间标记为占用，避免执行过程中被回收
+    
+    Args:
+        user_id: 用户ID
+        
+    Yields:
+        DockerContainer: 用户专属的容器实例
+    """
+    while True:
+        container = get_docker_container(user_id=user_id)
+        with _get_user_container_lock(user_id):
+            # 容器可能在获取后被回收，此时重新获取
+            if _docker_containers.get(user_id) is container:
+                container.acquire()
+                break
+    try:
+        yield container
+    finally:
+        container.release()
+
+def reap_docker_containers(
+    idle_ttl: Optional[float] = None,
+    max_containers: Optional[int] = None
+) -> List[str]:
+    """回收空闲容器
+    
+    先停止空闲超过idle_ttl的容器，再按最近使用时间淘汰超出max_containers的容器。
+    正在执行代码的容器不会被回收，被回收的用户下次使用时会自动重建容器。
+    
+    Args:
+        idle_ttl: 空闲超时（秒），如不提供则使用DOCKER_CONTAINER_IDLE_TTL，0表示不按超时回收
+        max_containers: 最大存活容器数量，如不提供则使用DOCKER_MAX_CONTAINERS，0表示不限制
+        
+    Returns:
+        List[str]: 被回收容器的用户ID
+    """
+    idle_ttl = DOCKER_CONTAINER_IDLE_TTL if idle_ttl is None else idle_ttl
+    max_containers = DOCKER_MAX_CONTAINERS if max_containers is None else max_containers
+    now = time.time()
+    
+    with _containers_lock:
+        # 按最近使用时间从旧到新排序
+        candidates = sorted(
+            ((user_id, container) for user_id, container in _docker_containers.items() if container is not None),
+            key=lambda item: item[1].last_used
         )
-        _docker_containers[user_id].start()
+    
+    victims = []
+    live_count = len(candidates)
+    for user_id, container in candidates:
+        if container.busy:
+            continue
+        expired = idle_ttl > 0 and now - container.last_used > idle_ttl
+        over_limit = max_containers > 0 and live_count - len(victims) > max_containers
+        if expired or over_limit:
+            victims.append((user_id, container))
+    
+    reaped = []
+    for user_id, container in victims:
+        # 持有用户锁停止容器，保证同名容器不会在停止过程中被重建；
+        # 用户锁被占用说明该用户正在使用容器，跳过
+        user_lock = _get_user_container_lock(user_id)
+        if not user_lock.acquire(blocking=False):
+            continue
+        try:
+            with _containers_lock:
+                if _docker_containers.get(user_id) is not container or container.busy:
+                    continue
+                del _docker_containers[user_id]
+            print(f"回收空闲容器 {container.container_name}")
+            try:
+                container.stop()
+            except Exception as e:
+                print(f"回收容器失败: {str(e)}")
+            get_admission_controller().release(container)
+            reaped.append(user_id)
+        finally:
+            user_lock.release()
+    
+    return reaped
+
+def _reaper_loop():
+    last_snapshot_gc = 0.0
+    while not _reaper_stopped.wait(DOCKER_REAPER_INTERVAL):
+        try:
+            reap_docker_containers()
+        except Exception as e:
+            print(f"容器回收出错: {str(e)}")
         
-        # 确保用户基本工作目录存在
-        user_work_dir = os.path.join(BASE_WORK_DIR, user_id)
-        os.makedirs(user_work_dir, exist_ok=True)
+        # 定期清理过期的用户快照镜像
+        if DOCKER_USER_SNAPSHOTS and time.time() - last_snapshot_gc >= DOCKER_SNAPSHOT_GC_INTERVAL:
+            last_snapshot_gc = time.time()
+            try:
+                prune_snapshots(get_docker_client())
+            except Exception as e:
+                print(f"快照镜像清理出错: {str(e)}")
+
+def start_container_reaper() -> None:
+    """启动后台空闲容器回收线程"""
+    global _reaper_thread
     
-    return _docker_containers[user_id]
+    with _containers_lock:
+        if _reaper_thread is None or not _reaper_thread.is_alive():
+            _reaper_stopped.clear()
+            _reaper_thread = threading.Thread(target=_reaper_loop, name="docker-container-reaper", daemon=True)
+            _reaper_thread.start()
 
 def create_task_workspace(user_id: str, task_id: str) -> str:
     """为特定用户的任务创建工作空间
@@ -67,176 +343,424 @@ def create_task_workspace(user_id: str, task_id: str) -> str:
         
     Returns:
         str: 任务ID
+        
+    Raises:
+        ValueError: 用户ID不合法
     """
     global _task_directories
     
-    # 确保用户任务映射表存在
-    if user_id not in _task_directories:
-        _task_directories[user_id] = {}
+    validate_user_id(user_id)
     
     # 创建用户特定的任务工作目录
     user_task_dir = os.path.join(BASE_WORK_DIR, user_id, task_id)
     os.makedirs(user_task_dir, exist_ok=True)
     
     # 记录用户任务目录
-    _task_directories[user_id][task_id] = user_task_dir
+    with _task_directories_lock:
+        _task_directories.setdefault(user_id, {})[task_id] = user_task_dir
     
     return user_task_dir
 
+def get_task_workspace(user_id: str, task_id: str) -> str:
+    """获取特定用户任务的工作目录，不存在时在宿主机上创建
+    
+    任务目录位于容器挂载的用户工作目录下，只需在宿主机创建一次，容器内即可见。
+    
+    Args:
+        user_id: 用户ID
+        task_id: 任务ID
+        
+    Returns:
+        str: 任务工作目录
+    """
+    with _task_directories_lock:
+        task_dir = _task_directories.get(user_id, {}).get(task_id)
+    if task_dir is None:
+        task_dir = create_task_workspace(user_id, task_id)
+    return task_dir
+
+def _prepare_local_execution(code: str, language: str, task_dir: str) -> Tuple[List[str], str]:
+    """把代码写入任务目录下的临时文件，返回执行命令和临时文件路径
+    
+    Raises:
+        ValueError: 不支持的语言
+    """
+    if language == "python":
+        file_extension, interpreter = ".py", "python"
+    elif language in ["bash", "sh"]:
+        file_extension, interpreter = ".sh", "bash"
+    else:
+        raise ValueError(f"不支持的语言: {language}")
+    
+    with tempfile.NamedTemporaryFile(suffix=file_extension, dir=task_dir, delete=False) as temp_file:
+        temp_file.write(code.encode('utf-8'))
+    if interpreter == "bash":
+        # 确保shell脚本有执行权限
+        os.chmod(temp_file.name, 0o755)
+    return [interpreter, temp_file.name], temp_file.name
+
+def _register_local_execution(user_id: str, task_id: str, pid: int) -> Dict[str, Any]:
+    execution = {"cancelled": False, "cancel": lambda: _kill_process_group(pid, signal.SIGTERM)}
+    with _active_executions_lock:
+        _active_executions[(user_id, task_id)] = execution
+    return execution
+
+def _unregister_local_execution(user_id: str, task_id: str, execution: Dict[str, Any]) -> None:
+    with _active_executions_lock:
+        if _active_executions.get((user_id, task_id)) is execution:
+            del _active_executions[(user_id, task_id)]
+
+def _local_result(
+    user_id: str,
+    task_id: str,
+    task_dir: str,
+    success: bool,
+    output: str = "",
+    error: str = "",
+    **extra: Any
+) -> str:
+    """生成本地执行的JSON结果"""
+    return json.dumps({
+        "user_id": user_id,
+        "task_id": task_id,
+        "success": success,
+        "output": output,
+        "error": error,
+        **extra,
+        "working_directory": task_dir
+    })
+
+def _local_execution_result(
+    user_id: str,
+    task_id: str,
+    task_dir: str,
+    returncode: int,
+    stdout: str,
+    stderr: str,
+    timeout: Optional[float],
+    timed_out: bool,
+    execution: Dict[str, Any]
+) -> str:
+    extra: Dict[str, Any] = {"exit_code": returncode}
+    error = stderr
+    if timed_out:
+        extra["timed_out"] = True
+        error += f"\n执行时间超过 {timeout} 秒，进程已被终止"
+    if execution["cancelled"]:
+        extra["cancelled"] = True
+    return _local_result(
+        user_id,
+        task_id,
+        task_dir,
+        returncode == 0 and not timed_out,
+        stdout,
+        error,
+        **extra
+    )
+
+def _execute_local_pooled(code: str, user_id: str, task_id: str, task_dir: str, timeout: Optional[float]) -> str:
+    """在预加载了常用库的本地工作进程池中执行Python代码"""
+    executions: List[Dict[str, Any]] = []
+    
+    def register(pid: int) -> None:
+        executions.append(_register_local_execution(user_id, task_id, pid))
+    
+    try:
+        exit_code, stdout, stderr, timed_out = get_local_worker_pool().run(code, task_dir, timeout, on_start=register)
+    except Exception as e:
+        return _local_result(user_id, task_id, task_dir, False, error=f"执行时发生错误: {str(e)}")
+    finally:
+        for execution in executions:
+            _unregister_local_execution(user_id, task_id, execution)
+    
+    return _local_execution_result(
+        user_id, task_id, task_dir, exit_code, stdout, stderr, timeout, timed_out, executions[0]
+    )
+
 def execute_code_local(
     code: str,
     language: str,
     user_id: str,
-    task_id: str
+    task_id: str,
+    timeout: Optional[float] = None
 ) -> str:
     """
     在本地环境中执行代码的函数
     
+    代码在子进程中以任务目录为工作目录执行，不修改当前进程的工作目录，也不创建事件循环，
+    可以在多个线程中并发调用。
+    
     Args:
         code: 要执行的代码
         language: 代码语言 ("python", "bash", "sh")
         user_id: 用户ID，区分不同用户
         task_id: 任务ID，如果不提供则创建新任务
+        timeout: 最长执行时间（秒），超时后执行被终止，结果中timed_out为true；不提供时使用默认限制
         
     Returns:
         字符串结果，包含输出或错误信息
     """
-    # 确保用户任务映射表存在
-    if user_id not in _task_directories:
-        _task_directories[user_id] = {}
-    
     # 确保有任务ID和对应的工作目录
-    if task_id not in _task_directories.get(user_id, {}):
-        user_task_dir = create_task_workspace(user_id, task_id)
+    task_dir = get_task_workspace(user_id, task_id)
+    timeout = _resolve_timeout(timeout, EXECUTION_TIMEOUT)
     
-    task_dir = _task_directories[user_id][task_id]
+    if language == "python" and LOCAL_WORKER_POOL:
+        return _execute_local_pooled(code, user_id, task_id, task_dir, timeout)
     
-    # 创建临时文件保存代码
-    file_extension = ".py" if language == "python" else ".sh"
-    with tempfile.NamedTemporaryFile(suffix=file_extension, dir=task_dir, delete=False) as temp_file:
-        temp_file_path = temp_file.name
-        temp_file.write(code.encode('utf-8'))
+    try:
+        command, temp_file_path = _prepare_local_execution(code, language, task_dir)
+    except ValueError as e:
+        return _local_result(user_id, task_id, task_dir, False, error=str(e))
     
-    # 设置执行命令
-    if language == "python":
-        command = f"python {temp_file_path}"
-    elif language in ["bash", "sh"]:
-        # 确保shell脚本有执行权限
-        os.chmod(temp_file_path, 0o755)
-        command = f"bash {temp_file_path}"
-    else:
-        return json.dumps({
-            "user_id": user_id,
-            "task_id": task_id,
-            "success": False,
-            "output": "",
-            "error": f"不支持的语言: {language}",
-            "working_directory": task_dir
-        })
-    
-    # 执行命令
     try:
-        # 切换到任务目录
-        original_dir = os.getcwd()
-        os.chdir(task_dir)
-        
-        # 执行代码
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        process = loop.run_until_complete(asyncio.create_subprocess_shell(
+        # 子进程在独立的进程组中运行，超时或取消时结束整个进程组
+        process = subprocess.Popen(
             command,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        ))
-        stdout, stderr = loop.run_until_complete(process.communicate())
-        loop.close()
-        
-        # 还原工作目录
-        os.chdir(original_dir)
-        
-        # 清理临时文件
-        os.unlink(temp_file_path)
-        
-        # 返回结果
-        output = stdout.decode('utf-8')
-        error = stderr.decode('utf-8')
-        success = process.returncode == 0
+            cwd=task_dir,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True
+        )
+        execution = _register_local_execution(user_id, task_id, process.pid)
+        timed_out = False
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            _kill_process_group(process.pid, signal.SIGKILL)
+            stdout, stderr = process.communicate()
+        finally:
+            _unregister_local_execution(user_id, task_id, execution)
         
-        return json.dumps({
-            "user_id": user_id,
-            "task_id": task_id,
-            "success": success,
-            "output": output,
-            "error": error,
-            "working_directory": task_dir
-        })
+        return _local_execution_result(
+            user_id,
+            task_id,
+            task_dir,
+            process.returncode,
+            stdout.decode('utf-8', errors='replace'),
+            stderr.decode('utf-8', errors='replace'),
+            timeout,
+            timed_out,
+            execution
+        )
     
     except Exception as e:
-        # 还原工作目录
-        os.chdir(original_dir)
-        
+        return _local_result(user_id, task_id, task_dir, False, error=f"执行时发生错误: {str(e)}")
+    
+    finally:
         # 清理临时文件
         if os.path.exists(temp_file_path):
             os.unlink(temp_file_path)
-        
-        return json.dumps({
-            "user_id": user_id,
-            "task_id": task_id,
-            "success": False,
-            "output": "",
-            "error": f"执行时发生错误: {str(e)}",
-            "working_directory": task_dir
-        })
     
-def execute_code_docker(
+def add_output_listener(listener: Callable[[str, str, str, str], None]) -> None:
+    """注册执行输出监听器，用于在界面上实时展示部分输出
+    
+    Args:
+        listener: 回调函数，参数为 (user_id, task_id, stream, text)，stream为"stdout"或"stderr"
+    """
+    with _output_listeners_lock:
+        _output_listeners.append(listener)
+
+def remove_output_listener(listener: Callable[[str, str, str, str], None]) -> None:
+    """移除执行输出监听器"""
+    with _output_listeners_lock:
+        if listener in _output_listeners:
+            _output_listeners.remove(listener)
+
+def _notify_output_listeners(user_id: str, task_id: str, stream: str, text: str) -> None:
+    with _output_listeners_lock:
+        listeners = list(_output_listeners)
+    for listener in listeners:
+        try:
+            listener(user_id, task_id, stream, text)
+        except Exception as e:
+            print(f"输出监听器出错: {str(e)}")
+
+def cancel_execution(user_id: str, task_id: str) -> bool:
+    """取消特定用户任务中正在进行的执行（Docker或本地）
+    
+    Args:
+        user_id: 用户ID
+        task_id: 任务ID
+        
+    Returns:
+        bool: 是否有正在进行的执行被取消
+    """
+    with _active_executions_lock:
+        execution = _active_executions.get((user_id, task_id))
+    if execution is None or "cancel" not in execution:
+        return False
+    execution["cancelled"] = True
+    return execution["cancel"]()
+
+def _kill_process_group(pid: int, sig: int) -> bool:
+    """结束本地执行的进程组"""
+    try:
+        os.killpg(pid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+def _resolve_timeout(timeout: Optional[float], default: float) -> Optional[float]:
+    """未指定时使用默认值，0表示不限制"""
+    timeout = default if timeout is None else timeout
+    return timeout if timeout and timeout > 0 else None
+
+def stream_code_docker(
     code: str,
     language: str,
     user_id: str,
-    task_id: str
-) -> str:
+    task_id: str,
+    timeout: Optional[float] = None,
+    cpu_timeout: Optional[float] = None
+) -> Iterator[Dict[str, Any]]:
     """
-    在Docker容器中执行代码的函数
+    在Docker容器中执行代码并逐块返回输出
     
     Args:
         code: 要执行的代码
         language: 代码语言 ("python", "bash", "sh")
         user_id: 用户ID，区分不同用户
         task_id: 任务ID，如果不提供则创建新任务
+        timeout: 墙钟时间限制（秒），如不提供则使用EXECUTION_TIMEOUT，0表示不限制
+        cpu_timeout: CPU时间限制（秒），如不提供则使用EXECUTION_CPU_TIMEOUT，0表示不限制
         
-    Returns:
-        字符串结果，包含输出或错误信息
+    Yields:
+        {"type": "stdout"/"stderr", "text": ...}，最后一个事件为 {"type": "result", "result": 结构化执行结果}
     """
-    # 确保用户任务映射表存在
-    if user_id not in _task_directories:
-        _task_directories[user_id] = {}
-    
     # 确保有任务ID和对应的工作目录
-    if task_id not in _task_directories.get(user_id, {}):
-        user_task_dir = create_task_workspace(user_id, task_id)
+    task_dir = get_task_workspace(user_id, task_id)
     
-    task_dir = _task_directories[user_id][task_id]
+    execution_id = f"EXEC-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    execution = {"execution_id": execution_id, "cancelled": False}
+    # 分别有界收集stdout与stderr，超出限制的完整输出写入任务目录下的日志文件
+    captures = {
+        "stdout": OutputCapture(execution_log_path(task_dir, execution_id, "stdout")),
+        "stderr": OutputCapture(execution_log_path(task_dir, execution_id, "stderr"))
+    }
+    exit_event: Dict[str, Any] = {"exit_code": -1, "error": ""}
+    start_time = time.perf_counter()
     
-    # 获取用户专属的Docker容器
-    container = get_docker_container(user_id=user_id)
+    installed_packages: List[str] = []
+    install_error = ""
     
-    # 设置工作目录为当前任务目录
-    print(f"user_id: {user_id}, task_id: {task_id}, task_dir: {task_dir}")
-    container.set_work_dir(task_dir)
+    # 在宿主机上预先检查语法，语法错误的代码无需进入容器执行
+    code = strip_code_fences(code, language)
+    syntax_error = validate_code(code, language)
+    if syntax_error:
+        exit_event = {"exit_code": 1, "error": ""}
+        captures["stderr"].write(syntax_error)
+        captures["stderr"].close()
+        _notify_output_listeners(user_id, task_id, "stderr", syntax_error)
+        yield {"type": "stderr", "text": syntax_error}
+    else:
+        # 获取用户专属的Docker容器
+        with acquire_docker_container(user_id=user_id) as container:
+            print(f"user_id: {user_id}, task_id: {task_id}, task_dir: {task_dir}")
+            
+            execution["container"] = container
+            execution["cancel"] = lambda: container.cancel(execution["execution_id"])
+            with _active_executions_lock:
+                _active_executions[(user_id, task_id)] = execution
+            try:
+                # 执行前安装代码导入但容器中缺失的第三方包，工作目录下的本地模块不会被安装
+                # 安装同样受执行时间限制，卡住的pip不会超过EXECUTION_TIMEOUT
+                if language == "python" and DOCKER_AUTO_INSTALL_PACKAGES:
+                    try:
+                        installed_packages, install_error = container.install_missing_packages(
+                            third_party_imports(code),
+                            work_dir=task_dir,
+                            timeout=_resolve_timeout(timeout, EXECUTION_TIMEOUT)
+                        )
+                    except Exception as e:
+                        # 安装失败不影响执行，错误随结果返回
+                        install_error = f"自动安装缺失的包失败: {str(e)}\n"
+                
+                # 执行代码，工作目录按调用传入，同一任务的Python代码在常驻内核中执行
+                for event in container.execute_stream(
+                    code,
+                    language,
+                    work_dir=task_dir,
+                    session_id=task_id,
+                    execution_id=execution["execution_id"],
+                    timeout=_resolve_timeout(timeout, EXECUTION_TIMEOUT),
+                    cpu_timeout=_resolve_timeout(cpu_timeout, EXECUTION_CPU_TIMEOUT)
+                ):
+                    if event["type"] == "exit":
+                        exit_event = event
+                        continue
+                    captures[event["type"]].write(event["text"])
+                    _notify_output_listeners(user_id, task_id, event["type"], event["text"])
+                    yield event
+            finally:
+                for capture in captures.values():
+                    capture.close()
+                with _active_executions_lock:
+                    if _active_executions.get((user_id, task_id)) is execution:
+                        del _active_executions[(user_id, task_id)]
     
-    # 执行代码
-    result = container.execute(code, language)
+    result = build_execution_result(
+        captures["stdout"].text(),
+        captures["stderr"].text(),
+        exit_event["exit_code"],
+        exit_event["error"],
+        {key: exit_event.get(key) for key in EXECUTION_METRICS}
+    )
     
-    # 返回输出或错误 - 使用结构化JSON格式
+    # 返回输出或错误 - 使用结构化JSON格式，output为stdout，error为stderr（成功时可能包含警告）
     result_data = {
         "user_id": user_id,
         "task_id": task_id,
-        "success": not result["error"],
-        "output": result["output"] if not result["error"] else "",
-        "error": result["error"] if result["error"] else "",
+        "success": result["success"],
+        "output": result["output"],
+        "error": result["error"],
+        "exit_code": result["exit_code"],
+        "wall_time": result["wall_time"],
+        "cpu_time": result["cpu_time"],
+        "peak_memory_kb": result["peak_memory_kb"],
+        # 宿主机视角的端到端耗时，包含容器调用开销
+        "total_time": round(time.perf_counter() - start_time, 6),
         "working_directory": task_dir
     }
+    result_data.update(captures["stdout"].stats("output"))
+    result_data.update(captures["stderr"].stats("error"))
+    if execution["cancelled"]:
+        result_data["cancelled"] = True
+    if exit_event.get("timed_out"):
+        result_data["timed_out"] = True
+    if syntax_error:
+        result_data["syntax_error"] = True
+    if installed_packages:
+        result_data["installed_packages"] = installed_packages
+    if install_error:
+        result_data["install_error"] = install_error[-INSTALL_ERROR_MAX_CHARS:]
     
-    return json.dumps(result_data)
+    yield {"type": "result", "result": result_data}
+
+def execute_code_docker(
+    code: str,
+    language: str,
+    user_id: str,
+    task_id: str,
+    timeout: Optional[float] = None
+) -> str:
+    """
+    在Docker容器中执行代码的函数
+    
+    Args:
+        code: 要执行的代码
+        language: 代码语言 ("python", "bash", "sh")
+        user_id: 用户ID，区分不同用户
+        task_id: 任务ID，如果不提供则创建新任务
+        timeout: 最长执行时间（秒），超时后执行被终止，结果中timed_out为true；不提供时使用默认限制
+        
+    Returns:
+        字符串结果，包含输出或错误信息
+    """
+    # 部分输出通过输出监听器实时推送，这里只返回最终结果
+    for event in stream_code_docker(code, language, user_id, task_id, timeout=timeout):
+        if event["type"] == "result":
+            return json.dumps(event["result"])
 
 def execute_browser_task(
     task_description: str, 
@@ -256,32 +780,128 @@ def execute_browser_task(
     """
     shell_code = f'python /app/agent_browser.py -t "{task_description}"'
     
-    # 确保用户任务映射表存在
-    if user_id not in _task_directories:
-        _task_directories[user_id] = {}
+    return execute_code_docker(shell_code, "bash", user_id, task_id)
+
+# 异步版本 - 在有界线程池中执行阻塞的docker-py调用，不阻塞事件循环
+async def aexecute_code_docker(
+    code: str,
+    language: str,
+    user_id: str,
+    task_id: str,
+    timeout: Optional[float] = None
+) -> str:
+    """
+    在Docker容器中执行代码的异步函数
     
-    # 确保有任务ID和对应的工作目录
-    if task_id not in _task_directories.get(user_id, {}):
-        user_task_dir = create_task_workspace(user_id, task_id)
+    Args:
+        code: 要执行的代码
+        language: 代码语言 ("python", "bash", "sh")
+        user_id: 用户ID，区分不同用户
+        task_id: 任务ID，如果不提供则创建新任务
+        timeout: 最长执行时间（秒），超时后执行被终止，结果中timed_out为true；不提供时使用默认限制
+        
+    Returns:
+        字符串结果，包含输出或错误信息
+    """
+    return await run_blocking(execute_code_docker, code, language, user_id, task_id, timeout)
+
+async def aexecute_code_local(
+    code: str,
+    language: str,
+    user_id: str,
+    task_id: str,
+    timeout: Optional[float] = None
+) -> str:
+    """
+    在本地环境中执行代码的异步函数
     
-    task_dir = _task_directories[user_id][task_id]
+    直接在当前事件循环中等待子进程，不占用线程池。
+    
+    Args:
+        code: 要执行的代码
+        language: 代码语言 ("python", "bash", "sh")
+        user_id: 用户ID，区分不同用户
+        task_id: 任务ID，如果不提供则创建新任务
+        timeout: 最长执行时间（秒），超时后执行被终止，结果中timed_out为true；不提供时使用默认限制
+        
+    Returns:
+        字符串结果，包含输出或错误信息
+    """
+    task_dir = get_task_workspace(user_id, task_id)
+    timeout = _resolve_timeout(timeout, EXECUTION_TIMEOUT)
     
-    # 获取用户专属的Docker容器实例并执行命令
-    container = get_docker_container(user_id=user_id)
-    container.set_work_dir(task_dir)
+    if language == "python" and LOCAL_WORKER_POOL:
+        # 等待工作进程结束是阻塞调用，在线程池中进行
+        return await run_blocking(_execute_local_pooled, code, user_id, task_id, task_dir, timeout)
     
-    result = container.execute(shell_code, "bash")
+    try:
+        command, temp_file_path = _prepare_local_execution(code, language, task_dir)
+    except ValueError as e:
+        return _local_result(user_id, task_id, task_dir, False, error=str(e))
     
-    result_data = {
-        "user_id": user_id,
-        "task_id": task_id,
-        "success": not result["error"],
-        "output": result["output"] if not result["error"] else "",
-        "error": result["error"] if result["error"] else "",
-        "working_directory": task_dir
-    }
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=task_dir,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        execution = _register_local_execution(user_id, task_id, process.pid)
+        timed_out = False
+        # 输出由独立的读取任务收集，超时取消等待时不会丢失已经输出的内容
+        readers = asyncio.gather(process.stdout.read(), process.stderr.read())
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            _kill_process_group(process.pid, signal.SIGKILL)
+            await process.wait()
+        except asyncio.CancelledError:
+            # 调用方取消时不留下孤儿进程
+            _kill_process_group(process.pid, signal.SIGKILL)
+            readers.cancel()
+            raise
+        finally:
+            _unregister_local_execution(user_id, task_id, execution)
+        stdout, stderr = await readers
+        
+        return _local_execution_result(
+            user_id,
+            task_id,
+            task_dir,
+            process.returncode,
+            stdout.decode('utf-8', errors='replace'),
+            stderr.decode('utf-8', errors='replace'),
+            timeout,
+            timed_out,
+            execution
+        )
+    
+    except Exception as e:
+        return _local_result(user_id, task_id, task_dir, False, error=f"执行时发生错误: {str(e)}")
+    
+    finally:
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+async def aexecute_browser_task(
+    task_description: str, 
+    user_id: str, 
+    task_id: str
+) -> str:
+    """
+    异步执行浏览器任务并返回结果
     
-    return json.dumps(result_data)
+    Args:
+        task_description: 浏览器工作任务描述文本
+        user_id: 用户ID，区分不同用户
+        task_id: 任务ID，如果不提供则创建新任务
+        
+    Returns:
+        str: JSON格式的任务执行结果
+    """
+    return await run_blocking(execute_browser_task, task_description, user_id, task_id)
 
 # 创建LlamaIndex工具
 def create_code_executor_docker_tool():
@@ -290,6 +910,7 @@ def create_code_executor_docker_tool():
         name="docker_code_executor",
         description="在Docker容器中执行Python代码或Shell脚本。对于Python代码，使用language='python'；对于Shell脚本，使用language='bash'或'sh'。需要提供user_id区分不同用户，可以指定task_id继续在特定任务上下文中执行，不指定则创建新任务。",
         fn=execute_code_docker,
+        async_fn=aexecute_code_docker,
     )
  
 def create_code_executor_local_tool():
@@ -298,6 +919,7 @@ def create_code_executor_local_tool():
         name="local_code_executor",
         description="在本地环境中执行Python代码或Shell脚本。对于Python代码，使用language='python'；对于Shell脚本，使用language='bash'或'sh'。需要提供user_id区分不同用户，可以指定task_id继续在特定任务上下文中执行，不指定则创建新任务。",
         fn=execute_code_local,
+        async_fn=aexecute_code_local,
     )
 
 def create_browser_docker_tool():
@@ -306,22 +928,45 @@ def create_browser_docker_tool():
         name="browser_executor",
         description="执行浏览器相关任务，如搜索、浏览等。提供任务描述，工具将通过agent_browser.py执行相应操作。需要提供user_id区分不同用户。",
         fn=execute_browser_task,
+        async_fn=aexecute_browser_task,
     )
 
+# 任务结束后释放该任务占用的常驻Python内核
+def end_task(user_id: str, task_id: str) -> None:
+    """任务结束时调用：关闭任务的常驻内核，释放其中加载的数据占用的容器内存"""
+    with _containers_lock:
+        container = _docker_containers.get(user_id)
+    if container:
+        container.close_kernel(task_id)
+
 # 关闭特定用户的Docker容器
 def close_docker_container(user_id: str = "default"):
     global _docker_containers
-    if user_id in _docker_containers and _docker_containers[user_id]:
-        _docker_containers[user_id].stop()
-        _docker_containers[user_id] = None
+    with _get_user_container_lock(user_id):
+        with _containers_lock:
+            container = _docker_containers.pop(user_id, None)
+        if container:
+            container.stop()
+            get_admission_controller().release(container)
 
 # 关闭所有Docker容器
 def close_all_docker_containers():
-    global _docker_containers
-    for user_id, container in _docker_containers.items():
+    global _docker_containers, _warm_pool
+    _reaper_stopped.set()
+    # 先停止预热，避免关闭过程中又启动新容器
+    if _warm_pool:
+        _warm_pool.shutdown()
+        _warm_pool = None
+    with _containers_lock:
+        containers = list(_docker_containers.values())
+        _docker_containers = {}
+    for container in containers:
         if container:
             container.stop()
-    _docker_containers = {}
+            get_admission_controller().release(container)
+    # 等待容器停止时提交的快照构建完成后再关闭客户端
+    wait_for_snapshot_builds()
+    close_docker_client()
 
 def test_docker_container():
     # Get container instance
@@ -1,6 +1,9 @@
 import os
+import re
+import threading
 
-from typing import Dict, Any
+import httpx
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
 from llama_index.core.tools import FunctionTool
 from langchain_openai import ChatOpenAI
 from llama_index.llms.langchain import LangChainLLM
@@ -8,14 +11,42 @@ from langchain_google_vertexai.model_garden import ChatAnthropicVertex
 import logging
 
 from prompts import CODE_GENERATION_PROMPT
+from code_cache import get_code_cache
+from code_validation import check_python_syntax, strip_code_fences
 from dotenv import load_dotenv
 load_dotenv()
 
-def get_model(model_name, **kwargs):
-    """Get a model by name."""
+# LLM HTTP连接池：所有OpenAI兼容模型共享，保持长连接，避免每次调用重新建立TLS连接
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100"))
+LLM_HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+
+_http_client: httpx.Client = None
+_http_async_client: httpx.AsyncClient = None
+
+# 模型注册表：每个模型只创建一次，多个Agent并发共享
+_models: Dict[str, Any] = {}
+_llms: Dict[str, LangChainLLM] = {}
+_models_lock = threading.Lock()
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE
+    )
+
+def _get_http_clients():
+    """获取共享的同步/异步HTTP客户端，调用方需持有_models_lock"""
+    global _http_client, _http_async_client
 
-    print(f"model: {model_name}")
+    if _http_client is None:
+        _http_client = httpx.Client(limits=_http_limits(), timeout=None)
+        _http_async_client = httpx.AsyncClient(limits=_http_limits(), timeout=None)
+    return _http_client, _http_async_client
+
+def _create_model(model_name):
+    """按名称创建模型客户端"""
     if model_name == "deepseek-v3":
+        http_client, http_async_client = _get_http_clients()
         model = ChatOpenAI(
             model="deepseek-v3-cdp",
             temperature=0,
@@ -24,8 +55,11 @@ def get_model(model_name, **kwargs):
             max_retries=2,
             api_key=os.getenv('DEEPSEEK_API_KEY'),
             base_url=os.getenv('API_BASE_URL'),
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
     elif model_name.startswith("gpt-"):
+        http_client, http_async_client = _get_http_clients()
         model = ChatOpenAI(
             model=model_name,
             temperature=0,
@@ -34,8 +68,11 @@ def get_model(model_name, **kwargs):
             max_retries=2,
             api_key=os.environ["OPENAI_API_KEY"],
             base_url=f'{os.environ["OPENAI_BASE_URL"]}',
+            http_client=http_client,
+            http_async_client=http_async_client,
         )
     elif model_name == "claude-opus-4":
+        # Vertex客户端使用自己的传输层，复用同一个实例即可保持连接
         model = ChatAnthropicVertex(
             model=os.environ["CLAUDE_MODEL_NAME"], 
             temperature=0,
@@ -46,20 +83,205 @@ def get_model(model_name, **kwargs):
             location=os.environ["GCP_LOCATION"]
         )
     else:
-        raise ValueError
+        raise ValueError(f"不支持的模型: {model_name}")
     
     return model
 
+def get_model(model_name, **kwargs):
+    """Get a model by name.
+
+    每个模型只在第一次请求时创建，之后返回同一个线程安全的实例。
+    """
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            logging.info(f"创建模型客户端: {model_name}")
+            model = _models[model_name] = _create_model(model_name)
+    return model
+
+def get_llm(model_name) -> LangChainLLM:
+    """获取包装为LlamaIndex LLM的共享模型实例"""
+    model = get_model(model_name)
+    with _models_lock:
+        llm = _llms.get(model_name)
+        if llm is None:
+            llm = _llms[model_name] = LangChainLLM(llm=model)
+    return llm
+
+# 生成的代码存在语法错误时，带着错误信息重新生成的最大次数
+CODE_REPAIR_ATTEMPTS = int(os.getenv("CODE_REPAIR_ATTEMPTS", "1"))
+
+# 代码块的开始标记，以及可能的结束标记（单独成行的```）
+CODE_BLOCK_OPEN_PATTERN = re.compile(r"```[^\n`]*\n")
+CODE_BLOCK_CLOSE_PATTERN = re.compile(r"\n```[ \t]*(?=\n|$)")
+
+def build_code_prompt(
+    task_description: str,
+    user_id: str = "default",
+    task_id: str = None,
+    additional_context: str = ""
+) -> str:
+    """构造代码生成提示词"""
+    return f"""{CODE_GENERATION_PROMPT}
+
+用户ID: {user_id}
+任务ID: {task_id}
+任务描述：{task_description}
+额外上下文：{additional_context}
+
+请直接返回代码，无需其他解释。
+"""
+
+def build_repair_context(additional_context: str, code: str, error: str) -> str:
+    """把上一次生成的代码和语法错误加入额外上下文，用于重新生成"""
+    return f"""{additional_context}
+
+上一次生成的代码存在语法错误，请修正后返回完整代码：
+{error}
+上一次生成的代码：
+{code}"""
+
+def _chunk_text(chunk) -> str:
+    """取出LangChain流式消息块中的文本"""
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+class _CodeStreamState:
+    """累积流式输出，检测代码块结束位置
+
+    代码中可能包含```（例如字符串里的markdown），单独成行的```只有在其之前的代码块内容
+    能通过语法检查时才视为代码块结束；否则继续接收，直到模型输出结束。
+    """
+    def __init__(self):
+        self.text = ""
+        self.emitted = 0
+        self.complete = False
+        # 代码块内容的起始位置，以及下一次查找结束标记的位置
+        self._body_start: Optional[int] = None
+        self._scan_from = 0
+
+    def feed(self, delta: str) -> str:
+        """追加一段输出，返回可以交给调用方的新文本；代码块结束后截断其后的内容"""
+        self.text += delta
+        if "`" in self.text[self._scan_from:]:
+            self._find_block_end()
+        new_text = self.text[self.emitted:]
+        self.emitted = len(self.text)
+        return new_text
+
+    def _find_block_end(self) -> None:
+        if self._body_start is None:
+            opening = CODE_BLOCK_OPEN_PATTERN.search(self.text)
+            if opening is None:
+                return
+            self._body_start = self._scan_from = opening.end() - 1
+        for closing in CODE_BLOCK_CLOSE_PATTERN.finditer(self.text, self._scan_from):
+            # 结束标记后可能还有未到达的字符（例如```json开始的新代码块），留到下次再判断
+            if closing.end() == len(self.text):
+                return
+            self._scan_from = closing.end()
+            if check_python_syntax(self.text[self._body_start + 1:closing.start()]) is None:
+                self.text = self.text[:closing.end()]
+                self.complete = True
+                return
+
+def _cache_lookup(model_name: str, prompt: str, use_cache: bool):
+    """返回(缓存, 缓存键, 已缓存的代码)"""
+    cache = get_code_cache()
+    if cache is None:
+        return None, None, None
+    # 以完整提示词计算缓存键：提示词中的用户ID和任务ID会出现在生成的代码中（如工作目录路径），
+    # 不同用户或任务的结果不能互相复用
+    cache_key = cache.make_key(model_name, CODE_GENERATION_PROMPT, prompt)
+    return cache, cache_key, cache.get(cache_key) if use_cache else None
+
+def _cache_store(cache, cache_key: str, model_name: str, code: str) -> None:
+    """缓存生成结果，存在语法错误的代码不缓存"""
+    if cache is not None and code and check_python_syntax(strip_code_fences(code)) is None:
+        cache.put(cache_key, model_name, code)
+
+def stream_python_code(
+    model_name: str,
+    task_description: str,
+    user_id: str = "default",
+    task_id: str = None,
+    additional_context: str = "",
+    use_cache: bool = True
+) -> Iterator[str]:
+    """流式生成Python代码
+
+    逐段返回模型输出的新文本；模型输出完第一个完整的代码块后立即停止接收，
+    不等待代码块之后的解释文字。所有片段拼接后即为完整结果。
+    """
+    prompt = build_code_prompt(task_description, user_id, task_id, additional_context)
+    cache, cache_key, code = _cache_lookup(model_name, prompt, use_cache)
+    if code is not None:
+        yield code
+        return
+
+    state = _CodeStreamState()
+    stream = get_model(model_name).stream(prompt)
+    try:
+        for chunk in stream:
+            new_text = state.feed(_chunk_text(chunk))
+            if new_text:
+                yield new_text
+            if state.complete:
+                break
+    finally:
+        # 提前停止时关闭底层HTTP流
+        stream.close()
+
+    _cache_store(cache, cache_key, model_name, state.text.strip())
+
+async def astream_python_code(
+    model_name: str,
+    task_description: str,
+    user_id: str = "default",
+    task_id: str = None,
+    additional_context: str = "",
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """异步流式生成Python代码，行为与stream_python_code相同"""
+    prompt = build_code_prompt(task_description, user_id, task_id, additional_context)
+    cache, cache_key, code = _cache_lookup(model_name, prompt, use_cache)
+    if code is not None:
+        yield code
+        return
+
+    state = _CodeStreamState()
+    stream = get_model(model_name).astream(prompt)
+    try:
+        async for chunk in stream:
+            new_text = state.feed(_chunk_text(chunk))
+            if new_text:
+                yield new_text
+            if state.complete:
+                break
+    finally:
+        await stream.aclose()
+
+    _cache_store(cache, cache_key, model_name, state.text.strip())
+
 def create_code_generator_tool(
-    model_name: str = "gpt-4o"
+    model_name: str = "gpt-4o",
+    repair_attempts: int = CODE_REPAIR_ATTEMPTS
 ) -> FunctionTool:
-    """创建代码生成工具"""
+    """创建代码生成工具
+
+    Args:
+        model_name: 模型名称
+        repair_attempts: 生成的代码存在语法错误时，把错误反馈给模型重新生成的最大次数，0表示不修复
+    """
     
     def generate_python_code(
         task_description: str,
         user_id: str = "default",
         task_id: str = None,
-        additional_context: str = ""
+        additional_context: str = "",
+        use_cache: bool = True
     ) -> str:
         """
         根据任务描述生成Python代码
@@ -69,27 +291,56 @@ def create_code_generator_tool(
             user_id (str): 用户ID
             task_id (str): 任务ID
             additional_context (str): 额外的上下文信息
+            use_cache (bool): 是否使用已缓存的生成结果，需要重新生成时设为False
             
         Returns:
             str: 生成的Python代码
         """
-        llm = LangChainLLM(llm=get_model(model_name))
-        
-        prompt = f"""{CODE_GENERATION_PROMPT}
-
-用户ID: {user_id}
-任务ID: {task_id}
-任务描述：{task_description}
-额外上下文：{additional_context}
+        context = additional_context
+        for attempt in range(repair_attempts + 1):
+            chunks = stream_python_code(model_name, task_description, user_id, task_id, context, use_cache)
+            code = "".join(chunks).strip()
+            error = check_python_syntax(strip_code_fences(code))
+            if error is None:
+                break
+            context = build_repair_context(additional_context, code, error)
+        return code
 
-请直接返回代码，无需其他解释。
-"""
+    async def agenerate_python_code(
+        task_description: str,
+        user_id: str = "default",
+        task_id: str = None,
+        additional_context: str = "",
+        use_cache: bool = True
+    ) -> str:
+        """
+        根据任务描述异步生成Python代码
         
-        response = llm.complete(prompt)
-        return response.text.strip()
+        Args:
+            task_description (str): 任务描述
+            user_id (str): 用户ID
+            task_id (str): 任务ID
+            additional_context (str): 额外的上下文信息
+            use_cache (bool): 是否使用已缓存的生成结果，需要重新生成时设为False
+            
+        Returns:
+            str: 生成的Python代码
+        """
+        context = additional_context
+        for attempt in range(repair_attempts + 1):
+            chunks = []
+            async for chunk in astream_python_code(model_name, task_description, user_id, task_id, context, use_cache):
+                chunks.append(chunk)
+            code = "".join(chunks).strip()
+            error = check_python_syntax(strip_code_fences(code))
+            if error is None:
+                break
+            context = build_repair_context(additional_context, code, error)
+        return code
 
     return FunctionTool.from_defaults(
         fn=generate_python_code,
+        async_fn=agenerate_python_code,
         name="code_generator",
         description="根据任务描述生成Python代码的工具。需要提供user_id和task_id，返回可执行的Python代码字符串。"
     )
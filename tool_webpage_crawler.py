@@ -5,6 +5,7 @@ import requests
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urlparse
+from async_executor import run_blocking
 
 BASE_WORK_DIR = "/Users/pingcy/workspace/tasks"
 
@@ -93,8 +94,27 @@ def create_webpage_crawler_tool() -> FunctionTool:
         except Exception as e:
             raise Exception(f"Failed to crawl webpage: {str(e)}")
 
+    async def acrawl_webpage(
+        url: str,
+        user_id: str = "default",
+        task_id: Optional[str] = None
+    ) -> str:
+        """
+        异步采集网页内容并保存为文本文件
+        
+        Args:
+            url (str): 网页链接
+            user_id (str): 用户ID
+            task_id (str): 任务ID
+            
+        Returns:
+            str: 保存的文件完整路径
+        """
+        return await run_blocking(crawl_webpage, url, user_id, task_id)
+
     return FunctionTool.from_defaults(
         fn=crawl_webpage,
+        async_fn=acrawl_webpage,
         name="webpage_crawler",
         description="采集指定网页的内容,清洗后保存为文本文件。需要提供url、user_id和task_id。返回保存的文件路径。"
     )
@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 宿主机上的pip缓存目录和本地wheel仓库，设为空字符串时不使用
+# wheel仓库只读挂载到执行容器中；两者只有宿主机控制的构建容器可以写入
+PIP_CACHE_HOST_DIR = os.path.expanduser(os.getenv("PIP_CACHE_HOST_DIR", "~/.cache/agent_manus/pip"))
+WHEELHOUSE_HOST_DIR = os.path.expanduser(os.getenv("WHEELHOUSE_HOST_DIR", "~/.cache/agent_manus/wheelhouse"))
+
+# 共享目录在容器内的挂载路径
+CONTAINER_PIP_CACHE_DIR = "/var/cache/agent_manus/pip"
+CONTAINER_WHEELHOUSE_DIR = "/var/cache/agent_manus/wheelhouse"
+
+# wheel仓库清单文件名
+MANIFEST_NAME = "manifest.json"
+
+# 允许下载的包名（PEP 508 名称，不含版本约束和选项），防止把pip选项当作包名传入
+PACKAGE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?$")
+# 构建容器被强制结束时的退出码
+BUILD_TIMEOUT_EXIT_CODE = 137
+
+_wheelhouse: Optional["Wheelhouse"] = None
+_wheelhouse_lock = threading.Lock()
+
+
+def canonical_package_name(name: str) -> str:
+    """按PEP 503规范化包名"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+class Wheelhouse:
+    """宿主机上的本地wheel仓库
+
+    清单记录了哪些包（连同依赖）的wheel已经全部下载到仓库中，
+    这些包可以直接用 --no-index 离线安装，无需访问PyPI。
+    仓库只能由build()启动的构建容器写入，执行用户代码的容器只读挂载，
+    用户代码无法替换其他用户将要安装的wheel。
+    """
+    def __init__(self, host_dir: str = WHEELHOUSE_HOST_DIR):
+        self.host_dir = host_dir
+        self.manifest_path = os.path.join(host_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        # 同时只运行一个构建容器，避免并发写入同一个wheel文件
+        self._build_lock = threading.Lock()
+        os.makedirs(host_dir, exist_ok=True)
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def available(self, packages: Iterable[str]) -> bool:
+        """所有包是否都已在仓库中"""
+        manifest = self._load()
+        return all(canonical_package_name(package) in manifest for package in packages)
+
+    def record(self, packages: Iterable[str]) -> None:
+        """记录已下载到仓库中的包"""
+        with self._lock:
+            manifest = self._load()
+            for package in packages:
+                manifest[canonical_package_name(package)] = {"requested": package, "added_at": time.time()}
+            # 先写临时文件再替换，避免其他进程读到写了一半的清单
+            temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+            os.replace(temp_path, self.manifest_path)
+
+    def packages(self) -> List[str]:
+        """返回清单中的所有包名"""
+        return sorted(self._load())
+
+    def build(self, client, image: str, packages: List[str], timeout: Optional[float] = None) -> Tuple[int, str]:
+        """在独立的构建容器中下载包及其依赖的wheel到仓库，成功后记录到清单
+
+        构建容器使用基础镜像，不运行任何用户代码，不挂载用户目录，只可写挂载pip缓存和wheel仓库。
+
+        Args:
+            client: docker-py客户端
+            image: 构建容器的镜像，应与执行容器的基础镜像一致以得到兼容的wheel
+            packages: pip包名
+            timeout: 最长时间（秒），包括等待其他构建完成的时间，超时后结束构建容器
+
+        Returns:
+            (退出码, pip输出)
+        """
+        invalid = [package for package in packages if not PACKAGE_NAME_PATTERN.match(package)]
+        if invalid:
+            return 1, f"非法的包名: {' '.join(invalid)}\n"
+
+        deadline = time.monotonic() + timeout if timeout else None
+        # 同一时间只运行一个构建容器，等待其他构建的时间也计入timeout
+        if not self._build_lock.acquire(timeout=max(timeout, 0) if timeout else -1):
+            return BUILD_TIMEOUT_EXIT_CODE, "等待其他wheel下载完成超时，已跳过\n"
+        try:
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return BUILD_TIMEOUT_EXIT_CODE, "等待其他wheel下载完成超时，已跳过\n"
+            container = client.containers.run(
+                image,
+                ["--disable-pip-version-check", "wheel", "--quiet", "--wheel-dir", CONTAINER_WHEELHOUSE_DIR, *packages],
+                entrypoint=["python", "-m", "pip"],
+                detach=True,
+                volumes=shared_pip_volumes(builder=True),
+                environment=shared_pip_environment(builder=True)
+            )
+            try:
+                try:
+                    exit_code = container.wait(timeout=timeout)["StatusCode"]
+                except Exception:
+                    # 等待超时（requests的ReadTimeout/ConnectionError）
+                    container.kill()
+                    return BUILD_TIMEOUT_EXIT_CODE, "下载wheel超时，已被终止\n"
+                output = container.logs().decode("utf-8", errors="replace")
+            finally:
+                try:
+                    container.remove(force=True)
+                except Exception:
+                    pass
+        finally:
+            self._build_lock.release()
+
+        if exit_code == 0:
+            self.record(packages)
+        return exit_code, output
+
+
+def get_wheelhouse() -> Optional[Wheelhouse]:
+    """获取共享的本地wheel仓库，WHEELHOUSE_HOST_DIR为空时返回None"""
+    global _wheelhouse
+
+    if not WHEELHOUSE_HOST_DIR:
+        return None
+    with _wheelhouse_lock:
+        if _wheelhouse is None:
+            _wheelhouse = Wheelhouse()
+
+    return _wheelhouse
+
+
+def shared_pip_volumes(builder: bool = False) -> Dict[str, Dict[str, str]]:
+    """返回需要挂载的共享pip目录
+
+    执行容器只读挂载wheel仓库；构建容器（builder=True）可写挂载wheel仓库和pip缓存。
+    """
+    directories = [(WHEELHOUSE_HOST_DIR, CONTAINER_WHEELHOUSE_DIR)]
+    if builder:
+        directories.append((PIP_CACHE_HOST_DIR, CONTAINER_PIP_CACHE_DIR))
+    volumes = {}
+    for host_dir, container_dir in directories:
+        if host_dir:
+            os.makedirs(host_dir, exist_ok=True)
+            volumes[host_dir] = {"bind": container_dir, "mode": "rw" if builder else "ro"}
+    return volumes
+
+
+def shared_pip_environment(builder: bool = False) -> Dict[str, str]:
+    """让容器内的pip优先从本地wheel仓库查找包，构建容器同时使用共享缓存"""
+    environment = {}
+    if PIP_CACHE_HOST_DIR and builder:
+        environment["PIP_CACHE_DIR"] = CONTAINER_PIP_CACHE_DIR
+    if WHEELHOUSE_HOST_DIR:
+        environment["PIP_FIND_LINKS"] = CONTAINER_WHEELHOUSE_DIR
+    return environment